@@ -1,49 +1,95 @@
+import time
+
+# 起動時間の計測用（customtkinter の読み込みも含めるため、最初に記録する）
+STARTED_AT = time.perf_counter()
+
 import customtkinter as ctk
 import tkinter as tk
-import requests
-import pyperclip
+from tkinter import filedialog, ttk
 from datetime import datetime
+import functools
 import os
+import queue
 import subprocess
 import threading
-import time
 import re
-import requests.exceptions
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sqlite3
+
+from probe_engine import (
+    MAX_WORKERS, RT_HUB_BASE_PORT, AP_BASE_PORT,
+    DEFAULT_TIMEOUT_SEC, DEFAULT_HUB_TIMEOUT_SEC,
+    DEVICE_RT, DEVICE_HUB, DEVICE_AP,
+    build_targets,
+    MODE_BATCH, MODE_HUB, MODE_AP,
+    ENGINE_THREAD, ENGINE_ASYNC,
+    create_engine, close_sessions, iter_sweeps,
+    DEFAULT_RETRY_ATTEMPTS, make_retry_policies,
+)
+from log_bus import LogBus
+from probe_scheduler import CancelToken, get_scheduler
+from probe_cache import ResultCache
+from probe_history import HistoryStore
+from probe_progress import ProgressGroup, ProgressModel, combine
+from probe_monitor import MONITOR_INTERVAL_SEC, Monitor
+from probe_metrics import METRICS_DIR, SLOWEST_PORTS, describe_timing, slowest_ports
+from probe_ratelimit import RATE_LIMIT_BURST, RATE_LIMIT_PER_SEC
+from probe_sitelist import SiteResultWriter, iter_site_file
 
 MAX_LINES = 10
-MAX_WORKERS = 10 # 並列処理で同時に実行する最大タスク数
-
-# --- アプリケーション設定定数 ---
-RT_HUB_BASE_PORT = 50000
-AP_BASE_PORT = 60000
-# デフォルトのタイムアウト値（GUIでの入力が不正だった場合に使われる）
-DEFAULT_TIMEOUT_SEC = 3
-DEFAULT_HUB_TIMEOUT_SEC = 7
-
-
-def open_url_in_chrome_force_tab(url, mainapp_instance):
-    chrome_paths = [
-        r"C:\Program Files\Google\Chrome\Application\chrome.exe",
-        r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe"
-    ]
-    chrome_path = None
-    for path in chrome_paths:
+STARTUP_TARGET_SEC = 1.0  # 起動（操作できるようになるまで）の目標時間。超えたら警告としてログに出す
+LOG_FLUSH_INTERVAL_MS = 100  # ログをまとめて画面に反映する間隔
+LOG_MAX_VISIBLE_LINES = 2000  # ログ欄に表示する最大行数（全履歴は logs/ に保存）
+PROGRESS_FRAME_MS = 100  # 進捗バーを描き直す間隔（10fps）
+NOTIFY_MARKER_MS = 3000  # 監視の通知をマーカーに表示しておく時間
+BULK_PARALLEL_SITES = 4  # 拠点リスト取込で同時に確認する拠点数
+
+
+CHROME_PATHS = (
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+)
+MAX_BROWSER_TABS = 20  # 1回の実行でブラウザに開くURLの上限（画面の「タブ上限」の初期値）
+
+
+@functools.lru_cache(maxsize=1)
+def find_chrome_path():
+    """Chrome の実行ファイルを探す（結果はプロセス内でキャッシュする）"""
+    for path in CHROME_PATHS:
         if os.path.exists(path):
-            chrome_path = path
-            break
-    if chrome_path:
+            return path
+    return None
+
+
+def open_urls_in_chrome(urls, mainapp_instance, max_tabs=MAX_BROWSER_TABS):
+    """urls を1回の Chrome 起動でまとめてタブに開く
+
+    起動は別スレッドで行うため、ログや集計の出力を待たせない。
+    """
+    urls = list(dict.fromkeys(urls))  # 同じURLは1回だけ開く
+    if not urls:
+        return
+    if len(urls) > max_tabs:
+        mainapp_instance.append_log(
+            f"ブラウザで開くURLが上限（{max_tabs}件）を超えたため、{len(urls) - max_tabs}件は開きません", level="warn")
+        urls = urls[:max_tabs]
+
+    def launch():
+        chrome_path = find_chrome_path()
+        if chrome_path is None:
+            mainapp_instance.append_log("Chromeが見つかりません", level="warn")
+            return
         try:
-            subprocess.Popen([chrome_path, "--new-tab", url])
-            return True
+            subprocess.Popen([chrome_path, "--new-tab", *urls])
         except OSError as e:
-            # --- 変更点1：エラーをGUIログに出力 ---
             mainapp_instance.append_log(f"Chrome起動失敗: {e}", level="warn")
-            return False
-    else:
-        # --- 変更点1：エラーをGUIログに出力 ---
-        mainapp_instance.append_log("Chromeが見つかりません", level="warn")
-        return False
+
+    threading.Thread(target=launch, daemon=True).start()
+
+
+def copy_to_clipboard(text):
+    """text をクリップボードにコピーする（pyperclip は起動時ではなく最初のコピーで読み込む）"""
+    import pyperclip
+    pyperclip.copy(text)
 
 class MainApp(ctk.CTk):
     def __init__(self):
@@ -52,8 +98,27 @@ class MainApp(ctk.CTk):
         self.geometry("1130x700")
         ctk.set_appearance_mode("dark")
 
-        # --- 変更点3：緊急停止用のイベントフラグ ---
-        self.stop_event = threading.Event()
+        # --- 緊急停止：実行ごとの停止トークンと進捗。全回線で1つのスケジューラーを共有する ---
+        self.scheduler = get_scheduler()
+        self.active_runs = {}  # 停止トークン -> ProgressModel
+        # 実行中の実行と並行して完了した実行の (完了数, 総数) の合計（次の実行開始まで残す）。
+        # モデル自体は残さないため、拠点リスト取込の間に何度実行しても増えない
+        self.finished_progress = (0, 0)
+        self.background_runs = set()  # 監視など終わりのない実行の停止トークン（進捗バーに含めない）
+        self.tokens_lock = threading.Lock()
+
+        # ワーカースレッドからのログはキューに積み、Tkスレッドでまとめて表示する
+        self.log_bus = LogBus()
+        # 監視で状態が変わった時の通知（Tkスレッドで音とマーカー表示を行う）
+        self.notifications = queue.SimpleQueue()
+        # ワーカースレッドからの画面の更新（ボタン・ステータス表示など）。_flush_log で Tkスレッドから呼ぶ
+        self.ui_updates = queue.SimpleQueue()
+
+        # 回線ごとの最新の実行で応答が遅かったポート（「遅いポート」パネルに表示する）
+        self.slow_ports = {}
+        self.slow_ports_lock = threading.Lock()
+        self.slow_ports_dirty = False
+        self.slow_panel_visible = False
 
         self.base_bg = "#212121"
         self.frame_border = "#424242"
@@ -67,6 +132,13 @@ class MainApp(ctk.CTk):
             "cleared", "summary_rt", "summary_hub", "summary_ap"
         )
 
+        # 全ての確認結果を SQLite の履歴に保存する（開けない場合は保存しない）。append_log が log_tags を使うため、その後で開く
+        try:
+            self.history = HistoryStore()
+        except (sqlite3.Error, OSError) as e:
+            self.history = None
+            self.append_log(f"履歴DBを開けません。履歴は保存されません: {e}", level="warn")
+
         self.configure(fg_color=self.base_bg)
 
         self.lines_var = tk.IntVar(value=1)
@@ -78,6 +150,18 @@ class MainApp(ctk.CTk):
         self.lines_entry = ctk.CTkEntry(top_frame, textvariable=self.lines_var, width=50)
         self.lines_entry.pack(side="left")
         ctk.CTkLabel(top_frame, text="（1〜10）", width=60).pack(side="left", padx=5)
+        ctk.CTkButton(top_frame, text="全回線一括実行", command=self.run_all_lines,
+                      fg_color="#4FC3F7", hover_color="#0091EA", text_color="#212121",
+                      width=140, font=ctk.CTkFont(weight="bold", size=13)).pack(side="left", padx=(18, 5))
+        ctk.CTkButton(top_frame, text="拠点リスト取込", command=self.import_site_list,
+                      fg_color="#7E57C2", hover_color="#5E35B1", width=120).pack(side="left", padx=5)
+        # RT 1台あたりの新規接続のレート制限（全回線・全ての確認で共有）
+        ctk.CTkLabel(top_frame, text="接続/秒", width=50).pack(side="left", padx=(18, 2))
+        self.rate_var = tk.StringVar(value=str(RATE_LIMIT_PER_SEC))
+        ctk.CTkEntry(top_frame, textvariable=self.rate_var, width=45).pack(side="left")
+        ctk.CTkLabel(top_frame, text="バースト", width=50).pack(side="left", padx=(8, 2))
+        self.burst_var = tk.StringVar(value=str(RATE_LIMIT_BURST))
+        ctk.CTkEntry(top_frame, textvariable=self.burst_var, width=45).pack(side="left")
 
         self.access_mode = tk.StringVar(value="browser")
         access_frame = ctk.CTkFrame(self, fg_color=self.base_bg)
@@ -85,6 +169,30 @@ class MainApp(ctk.CTk):
         ctk.CTkLabel(access_frame, text="アクセス方式", width=100).pack(side="left", padx=(0, 5))
         ctk.CTkRadioButton(access_frame, text="web", variable=self.access_mode, value="browser").pack(side="left")
         ctk.CTkRadioButton(access_frame, text="requests", variable=self.access_mode, value="requests").pack(side="left")
+        ctk.CTkLabel(access_frame, text="タブ上限", width=60).pack(side="left", padx=(10, 2))
+        self.tab_limit_var = tk.StringVar(value=str(MAX_BROWSER_TABS))
+        ctk.CTkEntry(access_frame, textvariable=self.tab_limit_var, width=40).pack(side="left")
+
+        self.engine_mode = tk.StringVar(value=ENGINE_THREAD)
+        ctk.CTkLabel(access_frame, text="エンジン", width=80).pack(side="left", padx=(20, 5))
+        ctk.CTkRadioButton(access_frame, text="スレッド", variable=self.engine_mode, value=ENGINE_THREAD).pack(side="left")
+        ctk.CTkRadioButton(access_frame, text="asyncio", variable=self.engine_mode, value=ENGINE_ASYNC).pack(side="left")
+
+        self.prescan_var = tk.BooleanVar(value=True)
+        ctk.CTkCheckBox(access_frame, text="TCP事前スキャン", variable=self.prescan_var).pack(side="left", padx=(20, 0))
+        self.adaptive_var = tk.BooleanVar(value=True)
+        ctk.CTkCheckBox(access_frame, text="適応タイムアウト", variable=self.adaptive_var).pack(side="left", padx=(10, 0))
+        self.hedge_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(access_frame, text="ヘッジ", variable=self.hedge_var).pack(side="left", padx=(10, 0))
+        self.auto_concurrency_var = tk.BooleanVar(value=True)
+        ctk.CTkCheckBox(access_frame, text="同時数自動", variable=self.auto_concurrency_var).pack(side="left", padx=(10, 0))
+        # 失敗したポートの機器種別ごとの最大試行回数（1 は再試行なし。応答のないポートはこの回数分タイムアウトを待つ）
+        ctk.CTkLabel(access_frame, text="試行回数", width=60).pack(side="left", padx=(10, 2))
+        self.attempts_vars = {}
+        for device in (DEVICE_RT, DEVICE_HUB, DEVICE_AP):
+            ctk.CTkLabel(access_frame, text=device, width=28).pack(side="left", padx=(4, 1))
+            self.attempts_vars[device] = tk.StringVar(value=str(DEFAULT_RETRY_ATTEMPTS))
+            ctk.CTkEntry(access_frame, textvariable=self.attempts_vars[device], width=30).pack(side="left")
 
         main_frame = ctk.CTkFrame(self, fg_color=self.base_bg)
         main_frame.pack(fill="both", expand=True, padx=10, pady=(2, 2))
@@ -93,10 +201,11 @@ class MainApp(ctk.CTk):
         self.left_card.pack(side="left", fill="both", padx=(0, 12), pady=8)
         self.left_card.pack_propagate(False)
 
-        self.tabview = ctk.CTkTabview(self.left_card, fg_color=self.card_bg, width=730, height=600)
+        self.tabview = ctk.CTkTabview(self.left_card, fg_color=self.card_bg, width=730, height=600,
+                                      command=self.build_current_tab)
         self.tabview.pack(fill="both", expand=True, padx=(10, 10), pady=(16, 16))
         
-        self.line_frames = []
+        self.line_frames = []  # 回線ごとの LineTabFrame。まだ選択されていない回線は None
 
         sidebar = ctk.CTkFrame(main_frame, fg_color=self.log_bg, width=340, corner_radius=14)
         sidebar.pack(side="right", fill="both", expand=True, padx=(2, 4), pady=8)
@@ -119,11 +228,28 @@ class MainApp(ctk.CTk):
                                       width=80, height=20,
                                       fg_color="#616161", hover_color="#757575")
         clear_log_btn.pack(side="right", anchor="e")
+
+        self.slow_toggle_btn = ctk.CTkButton(log_title_frame, text="遅いポート",
+                                             command=self.toggle_slow_panel,
+                                             width=80, height=20,
+                                             fg_color="#455A64", hover_color="#607D8B")
+        self.slow_toggle_btn.pack(side="right", anchor="e", padx=(0, 6))
         
         ctk.CTkFrame(sidebar, height=1, fg_color="#405060").pack(fill="x", padx=8, pady=(1, 8))
 
+        # --- 遅いポート（表示切替式。初期状態は非表示） ---
+        self.slow_frame = ctk.CTkFrame(sidebar, fg_color="transparent")
+        ctk.CTkLabel(self.slow_frame, text="応答の遅いポート（最新の実行）", text_color="#FFD54F",
+                     font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w")
+        self.slow_text = tk.Text(
+            self.slow_frame, height=SLOWEST_PORTS, state="disabled", font=("Consolas", 10),
+            bg=self.log_bg, fg=self.log_fg, wrap="none", width=36, relief="flat", borderwidth=0
+        )
+        self.slow_text.pack(fill="x")
+
         log_frame = ctk.CTkFrame(sidebar, fg_color="transparent")
         log_frame.pack(fill="both", padx=2, pady=3, expand=True)
+        self.log_frame = log_frame
         self.log_text = tk.Text(
             log_frame, height=22, state="disabled", font=("Consolas", 11),
             bg=self.log_bg, fg=self.log_fg, insertbackground="#ECEFF1",
@@ -150,7 +276,10 @@ class MainApp(ctk.CTk):
 
         self.progress_var = tk.DoubleVar(value=0)
         self.progress_bar = ctk.CTkProgressBar(sidebar, variable=self.progress_var, width=220, height=10)
-        self.progress_bar.pack(pady=(12, 10), anchor="s")
+        self.progress_bar.pack(pady=(12, 2), anchor="s")
+        self.eta_var = tk.StringVar(value="")
+        ctk.CTkLabel(sidebar, textvariable=self.eta_var, text_color="#B0BEC5",
+                     font=ctk.CTkFont(size=11)).pack(anchor="s", pady=(0, 6))
 
         # --- 変更点3：緊急停止ボタンの追加 ---
         self.stop_button = ctk.CTkButton(sidebar, text="緊急停止", command=self.request_stop,
@@ -162,6 +291,14 @@ class MainApp(ctk.CTk):
         exit_btn.pack(anchor="s", pady=(4, 16))
 
         self.update_lines_count()
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
+        self.after(PROGRESS_FRAME_MS, self._sample_progress)
+        self.after_idle(self._report_startup_time)
+
+    def _report_startup_time(self):
+        """起動から最初のアイドル（画面が描画され操作できる状態）までの時間をログに出す"""
+        elapsed = time.perf_counter() - STARTED_AT
+        self.append_log(f"起動完了: {elapsed:.2f}秒", level="info" if elapsed < STARTUP_TARGET_SEC else "warn")
     
     def _on_horizontal_scroll(self, event):
         if event.delta > 0:
@@ -171,55 +308,421 @@ class MainApp(ctk.CTk):
 
     # --- 変更点3：緊急停止ボタンのコマンド ---
     def request_stop(self):
-        self.append_log("停止リクエスト受信。現在の処理が完了次第、中断します...", level="warn")
-        self.stop_event.set()
+        self.append_log("停止リクエスト受信。実行中の確認を中断します...", level="warn")
+        with self.tokens_lock:
+            tokens = list(self.active_runs)
+        for token in tokens:
+            token.cancel()
         self.stop_button.configure(state="disabled", text="停止中...")
 
+    def begin_run(self, name, progress=None, background=False):
+        """実行を1件登録し、その実行専用の停止トークンを返す（Tkスレッドで呼ぶ）
+
+        progress は複数拠点の実行の進捗。background が真の実行（監視）は終わりがないため進捗バーに含めない。
+        """
+        token = CancelToken(name)
+        with self.tokens_lock:
+            if self.background_runs.issuperset(self.active_runs):
+                self.finished_progress = (0, 0)
+            self.active_runs[token] = progress or ProgressModel()
+            if background:
+                self.background_runs.add(token)
+        self.stop_button.configure(state="normal", text="緊急停止")
+        return token
+
+    def end_run(self, token):
+        """実行の終了を登録する。ワーカースレッドから呼ばれるため、ボタンの更新は Tkスレッドに任せる"""
+        with self.tokens_lock:
+            model = self.active_runs.pop(token, None)
+            background = token in self.background_runs
+            self.background_runs.discard(token)
+            # 完了した実行も、監視以外の実行が全て終わるまでは進捗バーの合計に含める（完了時に 0 に戻らないように）
+            if model is not None and not background and not token.is_set():
+                done, total = self.finished_progress
+                self.finished_progress = (done + model.done, total + model.total)
+        self.call_on_ui(self._refresh_stop_button)
+
+    def call_on_ui(self, func, *args):
+        """func(*args) を Tkスレッドで呼ぶ。どのスレッドからでも呼べる（実際の呼び出しは _flush_log で行う）"""
+        self.ui_updates.put((func, args))
+
+    def _refresh_stop_button(self):
+        with self.tokens_lock:
+            remaining = len(self.active_runs)
+        if remaining == 0:
+            self.stop_button.configure(state="disabled", text="緊急停止")
+
+    def run_all_lines(self):
+        """IPが入力されている全回線の一括実行を同時に開始する"""
+        # 一度も選択していない回線は IP が未入力なので対象外
+        frames = [f for f in self.line_frames if f is not None and f.ip_entry.get().strip()]
+        if not frames:
+            self.append_log("全回線一括実行: IPアドレスが入力された回線がありません", level="warn")
+            return
+        self.append_log(f"全回線一括実行: {len(frames)}回線を同時に開始します", level="info")
+        for frame in frames:
+            frame.on_batch_execute()
+
+    def import_site_list(self):
+        """拠点リスト（CSV / TSV）の全拠点を確認し、結果を CSV に書き出す"""
+        path = filedialog.askopenfilename(
+            title="拠点リストを選択", filetypes=[("CSV / TSV", "*.csv *.tsv *.txt"), ("すべてのファイル", "*.*")])
+        if not path:
+            return
+        output = filedialog.asksaveasfilename(
+            title="結果の保存先", defaultextension=".csv", filetypes=[("CSV", "*.csv")],
+            initialfile=f"result_{datetime.now():%Y%m%d_%H%M%S}.csv")
+        if not output:
+            return
+        BulkImportWindow(self, path, output)
+
     def update_lines_count(self, *_):
         try:
             n = int(self.lines_var.get())
         except ValueError:
             n = 1
         n = max(1, min(MAX_LINES, n))
+        # タブの中身（数十個のウィジェット）は、その回線が最初に選択された時に作る
         while len(self.line_frames) < n:
             line_num = len(self.line_frames) + 1
-            tab = self.tabview.add(f"回線#{line_num}")
-            self.tabview.tab(f"回線#{line_num}").configure(fg_color=self.card_bg)
-            frame = LineTabFrame(tab, line_num, self)
-            frame.pack(fill="both", expand=True)
-            self.line_frames.append(frame)
+            self.tabview.add(f"回線#{line_num}").configure(fg_color=self.card_bg)
+            self.line_frames.append(None)
         while len(self.line_frames) > n:
             self.tabview.delete(f"回線#{len(self.line_frames)}")
             self.line_frames.pop()
+        # 選択中のタブを削除した場合は別のタブが選択されるため、その中身も用意する
+        self.build_current_tab()
+
+    def build_current_tab(self):
+        """選択中の回線タブの中身がまだなければ作る（タブを切り替えるたびに呼ばれる）"""
+        name = self.tabview.get()
+        if not name:
+            return
+        line_num = int(name[len("回線#"):])
+        if self.line_frames[line_num - 1] is None:
+            frame = LineTabFrame(self.tabview.tab(name), line_num, self)
+            frame.pack(fill="both", expand=True)
+            self.line_frames[line_num - 1] = frame
 
     def append_log(self, message, level="info"):
+        """どのスレッドからでも呼べる。実際の表示は _flush_log で行う"""
         ts = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
         tag = level if level in self.log_tags else "info"
-        self.log_text.config(state="normal")
-        self.log_text.insert("end", f"{ts} - {message}\n", tag)
-        self.log_text.see("end")
-        self.log_text.config(state="disabled")
+        self.log_bus.push(f"{ts} - {message}\n", tag)
+
+    def _flush_log(self):
+        """溜まったログを1回の insert でまとめて表示し、表示行数を上限内に保つ"""
+        batch = self.log_bus.drain()
+        if batch:
+            args = []
+            for line, tag in batch:
+                args.extend((line, tag))
+            self.log_text.config(state="normal")
+            self.log_text.insert("end", *args)
+            line_count = int(self.log_text.index("end-1c").split(".")[0])
+            if line_count > LOG_MAX_VISIBLE_LINES:
+                self.log_text.delete("1.0", f"{line_count - LOG_MAX_VISIBLE_LINES + 1}.0")
+            self.log_text.see("end")
+            self.log_text.config(state="disabled")
+        while True:
+            try:
+                func, args = self.ui_updates.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        if self.slow_panel_visible and self.slow_ports_dirty:
+            self._render_slow_ports()
+        self._show_notifications()
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
 
     def clear_log(self):
+        # 画面表示のみ消去する（履歴とログファイルは残る）
         self.log_text.config(state="normal")
         self.log_text.delete("1.0", "end")
-        self.append_log("ログをクリアしました", level="cleared")
         self.log_text.config(state="disabled")
+        self.append_log("ログをクリアしました", level="cleared")
+
+    def apply_rate_limit(self):
+        """「接続/秒」「バースト」の入力値を共有のレート制限に反映する（値が変わった場合のみ）
+
+        不正な値の場合は RATE_LIMIT_PER_SEC / RATE_LIMIT_BURST を使う。0 は制限なし。
+        """
+        try:
+            rate = float(self.rate_var.get())
+        except ValueError:
+            rate = RATE_LIMIT_PER_SEC
+        try:
+            burst = int(self.burst_var.get())
+        except ValueError:
+            burst = RATE_LIMIT_BURST
+        limiter = self.scheduler.rate_limiter
+        if (limiter.rate or 0) != (rate if rate > 0 else 0) or limiter.burst != max(1, burst):
+            limiter.configure(rate, burst)
+
+    def retry_policies(self):
+        """機器種別ごとの「試行回数」の入力値から作った再試行ポリシー。不正な値の機器種別は DEFAULT_RETRY_ATTEMPTS"""
+        attempts = {}
+        for device, var in self.attempts_vars.items():
+            try:
+                attempts[device] = max(1, int(var.get()))
+            except ValueError:
+                attempts[device] = DEFAULT_RETRY_ATTEMPTS
+        return make_retry_policies(attempts)
+
+    def engine_settings(self):
+        """画面の確認の設定を読み取り、(エンジンの種類, create_engine のオプション) を返す（Tkスレッドで呼ぶ）
+
+        ワーカースレッドから Tk の変数を読まないよう、実行の開始時にここで値を取り出して渡す。
+        """
+        self.apply_rate_limit()
+        return self.engine_mode.get(), dict(
+            max_workers=MAX_WORKERS,
+            prescan=self.prescan_var.get(),
+            adaptive=self.adaptive_var.get(),
+            hedge=self.hedge_var.get(),
+            adaptive_concurrency=self.auto_concurrency_var.get(),
+            retry_policies=self.retry_policies(),
+            history=self.history,
+            scheduler=self.scheduler,
+        )
+
+    def browser_tab_limit(self):
+        """「タブ上限」の入力値。不正な場合は MAX_BROWSER_TABS"""
+        try:
+            return max(1, int(self.tab_limit_var.get()))
+        except ValueError:
+            return MAX_BROWSER_TABS
+
+    def set_slow_ports(self, line_number, results):
+        """回線の最新の実行で遅かったポートを記録する。どのスレッドからでも呼べる"""
+        with self.slow_ports_lock:
+            self.slow_ports[line_number] = results
+            self.slow_ports_dirty = True
+
+    def toggle_slow_panel(self):
+        if self.slow_panel_visible:
+            self.slow_frame.pack_forget()
+            self.slow_panel_visible = False
+            return
+        self.slow_frame.pack(fill="x", padx=8, pady=(0, 6), before=self.log_frame)
+        self.slow_panel_visible = True
+        self._render_slow_ports()
+
+    def _render_slow_ports(self):
+        """全回線の結果を合わせ、合計時間の遅い順に表示する（Tkスレッドから呼ぶ）"""
+        with self.slow_ports_lock:
+            rows = [(line, r) for line, results in self.slow_ports.items() for r in results]
+            self.slow_ports_dirty = False
+        rows.sort(key=lambda row: row[1].elapsed, reverse=True)
+        lines = [f"回線#{line} {r.device} :{r.port} {describe_timing(r)}" for line, r in rows[:SLOWEST_PORTS]]
+        self.slow_text.config(state="normal")
+        self.slow_text.delete("1.0", "end")
+        self.slow_text.insert("end", "\n".join(lines) if lines else "（まだ結果がありません）")
+        self.slow_text.config(state="disabled")
+
+    def notify(self, message, color="#FFEB3B"):
+        """監視で状態が変わったことを知らせる。どのスレッドからでも呼べる"""
+        self.notifications.put((message, color))
+
+    def _show_notifications(self):
+        latest = None
+        while True:
+            try:
+                latest = self.notifications.get_nowait()
+            except queue.Empty:
+                break
+        if latest is None:
+            return
+        # 同時に複数届いた場合も、音は1回だけ鳴らして最後の通知を表示する
+        self.bell()
+        message, color = latest
+        self.set_log_marker(message, color)
+        self.after(NOTIFY_MARKER_MS, lambda: self.log_marker_var.get() == message and self.clear_log_marker())
 
     def set_log_marker(self, message, color="#FFEB3B"):
+        """どのスレッドからでも呼べる。表示の更新は Tkスレッドで行う"""
+        self.call_on_ui(self._show_log_marker, message, color)
+
+    def _show_log_marker(self, message, color):
         self.log_marker_label.configure(text_color=color)
         self.log_marker_var.set(message)
 
     def clear_log_marker(self):
-        self.log_marker_var.set("")
-
-    def update_progress(self, percent):
-        self.progress_var.set(percent)
-        self.progress_bar.update_idletasks()
+        """どのスレッドからでも呼べる"""
+        self.call_on_ui(self.log_marker_var.set, "")
+
+    def progress_for(self, token):
+        with self.tokens_lock:
+            return self.active_runs.get(token)
+
+    def _sample_progress(self):
+        """実行中の全回線の進捗を合算して描画する（Tkスレッドで一定間隔に呼ばれる）"""
+        with self.tokens_lock:
+            # 停止要求済みの実行と監視は残り時間の見積もりに含めない
+            models = [model for token, model in self.active_runs.items()
+                      if not token.is_set() and token not in self.background_runs]
+            finished_done, finished_total = self.finished_progress
+        done, total, eta = combine(models)
+        done += finished_done
+        total += finished_total
+        self.progress_var.set(done / total if total else 0.0)
+        if total and done < total:
+            eta_text = f"残り約{eta:.0f}秒" if eta is not None else "残り時間を計測中..."
+            self.eta_var.set(f"{done}/{total}件 {eta_text}")
+        else:
+            self.eta_var.set("")
+        self.after(PROGRESS_FRAME_MS, self._sample_progress)
 
     def on_exit(self):
+        close_sessions()
+        if self.history is not None:
+            self.history.close()
+        # 1回の drain() は LOG_DRAIN_MAX 件までなので、残りがなくなるまでファイルに書き出す
+        while self.log_bus.drain():
+            pass
+        self.log_bus.close()
+        self.destroy()
+
+class BulkImportWindow(ctk.CTkToplevel):
+    """拠点リストの全拠点を確認し、1拠点1行の集計表に表示するウィンドウ
+
+    拠点ごとのタブは作らない。拠点リストは1行ずつ読み、同時に確認するのは BULK_PARALLEL_SITES 拠点まで。
+    結果は拠点が終わるたびにファイルへ書き出し、画面には集計の行だけを残す。
+    """
+
+    COLUMNS = (("site", "拠点", 160), ("host", "ホスト", 140), ("rt", "RT", 50),
+               ("hub", "HUB", 80), ("ap", "AP", 80), ("concurrency", "同時数", 60), ("elapsed", "秒", 60))
+
+    def __init__(self, mainapp, path, output):
+        super().__init__(mainapp)
+        self.mainapp = mainapp
+        self.path = path
+        self.output = output
+        self.title(f"拠点リスト取込: {os.path.basename(path)}")
+        self.geometry("640x480")
+        self.configure(fg_color=mainapp.base_bg)
+        # 確認の設定は開始時点の画面の値を使う（ワーカースレッドから Tk の変数を読まない）
+        self.engine_kind, self.engine_options = mainapp.engine_settings()
+        # 拠点ごとにメトリクスファイルを書き出すと、数千拠点ではファイルが増えすぎるため書き出さない
+        self.engine_options["metrics_dir"] = None
+        self.rows = queue.SimpleQueue()  # ワーカースレッド -> Tkスレッド（None は終了の合図）
+        self.site_count = 0
+        self.failed_sites = 0
+
+        self.status_var = tk.StringVar(value="確認中...")
+        ctk.CTkLabel(self, textvariable=self.status_var, text_color="#B0BEC5").pack(anchor="w", padx=12, pady=(10, 4))
+
+        style = ttk.Style(self)
+        style.configure("Bulk.Treeview", background=mainapp.log_bg, fieldbackground=mainapp.log_bg,
+                        foreground=mainapp.log_fg, rowheight=22)
+        grid_frame = ctk.CTkFrame(self, fg_color="transparent")
+        grid_frame.pack(fill="both", expand=True, padx=10)
+        self.grid_view = ttk.Treeview(grid_frame, columns=[key for key, _, _ in self.COLUMNS],
+                                      show="headings", style="Bulk.Treeview")
+        for key, label, width in self.COLUMNS:
+            self.grid_view.heading(key, text=label)
+            self.grid_view.column(key, width=width, anchor="w" if key in ("site", "host") else "center")
+        self.grid_view.tag_configure("fail", foreground="#E57373")
+        y_scroll = ttk.Scrollbar(grid_frame, orient="vertical", command=self.grid_view.yview)
+        self.grid_view.configure(yscrollcommand=y_scroll.set)
+        y_scroll.pack(side="right", fill="y")
+        self.grid_view.pack(side="left", fill="both", expand=True)
+
+        self.stop_btn = ctk.CTkButton(self, text="停止", command=self.request_stop,
+                                      fg_color="#C62828", hover_color="#B71C1C", width=120)
+        self.stop_btn.pack(pady=10)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # 拠点ごとの進捗を合算して、メイン画面の進捗バーに出す
+        self.progress = ProgressGroup()
+        self.token = mainapp.begin_run("拠点リスト取込", self.progress)
+        mainapp.append_log(f"拠点リスト取込: {os.path.basename(path)} の確認を開始します", level="info")
+        threading.Thread(target=self._run, daemon=True).start()
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_rows)
+
+    def _log(self, label, message, level="info"):
+        # 拠点ごとの定常ログは集計表で足りるため、警告以上だけをログ欄に出す
+        if level != "info":
+            self.mainapp.append_log(f"{label}: {message}", level=level)
+
+    def _run_one(self, site):
+        label = site.get("name") or site["ip"]
+        progress = self.progress.child()
+        try:
+            engine = create_engine(self.engine_kind, stop_event=self.token, progress=progress,
+                                   on_log=functools.partial(self._log, label), **self.engine_options)
+            return engine.run_site(site, MODE_BATCH)
+        finally:
+            self.progress.release(progress)
+
+    @staticmethod
+    def _summary_row(sweep):
+        rt_success, rt_fail = sweep.counts(DEVICE_RT)
+        hub_success, hub_fail = sweep.counts(DEVICE_HUB)
+        ap_success, ap_fail = sweep.counts(DEVICE_AP)
+        failed = bool(rt_fail or hub_fail or ap_fail)
+        values = (
+            sweep.site.get("name") or sweep.site["ip"], sweep.site["ip"],
+            "OK" if rt_success else "NG",
+            f"{hub_success}/{hub_success + hub_fail}", f"{ap_success}/{ap_success + ap_fail}",
+            sweep.concurrency[1], f"{sweep.elapsed:.1f}",
+        )
+        return values, failed
+
+    def _run(self):
+        sites = iter_site_file(self.path, on_log=functools.partial(self._log, "拠点リスト取込"))
+        try:
+            # Excel で文字化けしないよう BOM 付きで書き出す
+            with open(self.output, "w", encoding="utf-8-sig", newline="") as fp:
+                writer = SiteResultWriter(fp)
+                for sweep in iter_sweeps(sites, self._run_one, BULK_PARALLEL_SITES):
+                    if sweep.stopped:
+                        break
+                    writer.write(sweep)
+                    self.rows.put(self._summary_row(sweep))
+        except (OSError, ValueError) as e:
+            self.mainapp.append_log(f"拠点リスト取込: 中断しました: {e}", level="warn")
+        finally:
+            self.mainapp.end_run(self.token)
+            self.rows.put(None)
+
+    def _flush_rows(self):
+        """ワーカースレッドから届いた集計行をまとめて表に追加する（Tkスレッドで一定間隔に呼ばれる）"""
+        if not self.winfo_exists():
+            return
+        finished = False
+        while True:
+            try:
+                row = self.rows.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                finished = True
+                break
+            values, failed = row
+            self.grid_view.insert("", "end", values=values, tags=("fail",) if failed else ())
+            self.site_count += 1
+            self.failed_sites += failed
+        summary = f"{self.site_count}拠点完了（失敗のある拠点 {self.failed_sites}件）"
+        if not finished:
+            self.status_var.set(f"確認中... {summary}")
+            self.after(LOG_FLUSH_INTERVAL_MS, self._flush_rows)
+            return
+        stopped = "停止しました" if self.token.is_set() else "完了"
+        self.status_var.set(f"{stopped}: {summary} 結果: {self.output}")
+        self.stop_btn.configure(state="disabled")
+        self.mainapp.append_log(f"拠点リスト取込 {stopped}: {summary} → {self.output}",
+                                level="warn" if self.failed_sites or self.token.is_set() else "success")
+
+    def request_stop(self):
+        self.token.cancel()
+        self.stop_btn.configure(state="disabled", text="停止中...")
+
+    def on_close(self):
+        self.token.cancel()
         self.destroy()
 
+
 class LineTabFrame(ctk.CTkFrame):
     def __init__(self, parent, number, mainapp):
         super().__init__(parent, fg_color=mainapp.card_bg, border_width=0, corner_radius=12)
@@ -227,6 +730,8 @@ class LineTabFrame(ctk.CTkFrame):
         self.number = number
         self.success_hub_urls = []
         self.success_ap_urls = []
+        # 「失敗のみ再確認」用に、この回線の直近の結果を (host, port) ごとに保持する
+        self.result_cache = ResultCache()
 
         self.WIDTH_IP_ENTRY = 180
         self.WIDTH_NUM_ENTRY = 60
@@ -249,7 +754,12 @@ class LineTabFrame(ctk.CTkFrame):
         self.batch_btn = ctk.CTkButton(iprow, text="一括実行", fg_color="#4FC3F7", hover_color="#0091EA",
                                        width=self.WIDTH_BTN_BATCH, font=ctk.CTkFont(weight="bold", size=13),
                                        command=self.on_batch_execute)
-        self.batch_btn.pack(side="left", padx=self.PAD_XLARGE)
+        self.batch_btn.pack(side="left", padx=(self.PAD_XLARGE, self.PAD_NORMAL))
+
+        self.recheck_btn = ctk.CTkButton(iprow, text="失敗のみ再確認", fg_color="#FFB74D", hover_color="#F57C00",
+                                         text_color="#212121", width=self.WIDTH_BTN_CLEAR + 10,
+                                         command=self.on_recheck_execute)
+        self.recheck_btn.pack(side="left", padx=(0, self.PAD_XLARGE))
 
         self.clear_inputs_btn = ctk.CTkButton(iprow, text="入力クリア",
                                               command=self.clear_inputs,
@@ -257,6 +767,21 @@ class LineTabFrame(ctk.CTkFrame):
                                               width=self.WIDTH_BTN_CLEAR)
         self.clear_inputs_btn.pack(side="left", padx=self.PAD_NORMAL)
 
+        ctk.CTkButton(iprow, text="履歴", command=self.show_last_responses,
+                      fg_color="#616161", hover_color="#757575", width=60).pack(side="left", padx=self.PAD_NORMAL)
+
+        # --- 継続監視（一定間隔で確認し直し、状態の変化のみ通知する） ---
+        monitor_row = ctk.CTkFrame(self, fg_color="transparent")
+        monitor_row.pack(anchor="w", pady=(2, 2), fill="x", padx=24)
+        ctk.CTkLabel(monitor_row, text="監視間隔 秒", width=105).pack(side="left", padx=(0, self.PAD_NORMAL))
+        self.monitor_interval_entry = ctk.CTkEntry(monitor_row, width=self.WIDTH_NUM_ENTRY)
+        self.monitor_interval_entry.insert(0, str(MONITOR_INTERVAL_SEC))
+        self.monitor_interval_entry.pack(side="left")
+        self.monitor_btn = ctk.CTkButton(monitor_row, text="監視開始", command=self.toggle_monitor,
+                                         fg_color="#7E57C2", hover_color="#5E35B1", width=self.WIDTH_BTN_CLEAR)
+        self.monitor_btn.pack(side="left", padx=(self.PAD_XLARGE, self.PAD_NORMAL))
+        self.monitor_token = None
+
         hub_group = ctk.CTkFrame(self, fg_color="#2B3A45", border_width=0, corner_radius=18)
         hub_group.pack(anchor="center", fill="x", padx=24, pady=(10, 5))
 
@@ -359,41 +884,58 @@ class LineTabFrame(ctk.CTkFrame):
 
         self.mainapp.append_log(f"回線#{self.number}: 入力内容をクリアしました", level="cleared")
 
-    def _exec_threaded(self, func, *args):
-        # --- 変更点3：ボタンの状態管理を修正 ---
+    def _exec_threaded(self, func, inputs, *args, background=False):
+        """func(停止トークン, inputs, 設定, *args) をワーカースレッドで実行し、停止トークンを返す
+
+        入力と設定はここ（Tkスレッド）で読み取って渡し、ワーカースレッドは Tk の変数やウィジェットを読まない。
+        入力が不正（inputs が None）なら実行せずに None を返す。
+        """
+        if not inputs:
+            return None
+        engine_kind, engine_options = self.mainapp.engine_settings()
+        settings = {
+            "engine_kind": engine_kind,
+            "engine_options": engine_options,
+            "browser": self.mainapp.access_mode.get() == "browser",
+            "tab_limit": self.mainapp.browser_tab_limit(),
+        }
         self.batch_btn.configure(state="disabled")
+        self.recheck_btn.configure(state="disabled")
         self.clear_inputs_btn.configure(state="disabled")
-        self.mainapp.stop_button.configure(state="normal", text="緊急停止")
-        self.mainapp.stop_event.clear()
+        token = self.mainapp.begin_run(f"回線#{self.number}", background=background)
 
         def run_and_reenable():
             try:
-                func(*args)
+                func(token, inputs, settings, *args)
             finally:
-                # 処理が正常終了、エラー、緊急停止のいずれでもUIを元に戻す
-                self.batch_btn.configure(state="normal")
-                self.clear_inputs_btn.configure(state="normal")
-                self.mainapp.stop_button.configure(state="disabled", text="緊急停止")
+                # 処理が正常終了、エラー、緊急停止のいずれでもUIを元に戻す（ボタンの更新は Tkスレッドで行う）
+                self.mainapp.call_on_ui(self._enable_run_buttons)
+                self.mainapp.end_run(token)
 
         t = threading.Thread(target=run_and_reenable, daemon=True)
         t.start()
+        return token
 
-    def _check_connection(self, url, timeout_sec):
-        try:
-            res = requests.get(url, timeout=timeout_sec)
-            # --- 変更点4：並列処理用に結果をタプルで返す ---
-            return True, url
-        except requests.exceptions.RequestException:
-            return False, url
+    def _enable_run_buttons(self):
+        self.batch_btn.configure(state="normal")
+        self.recheck_btn.configure(state="normal")
+        self.clear_inputs_btn.configure(state="normal")
+
+    def _set_status(self, status_var, text):
+        """HUB/AP のステータス表示を更新する。ワーカースレッドから呼ばれるため Tkスレッドに任せる"""
+        self.mainapp.call_on_ui(status_var.set, text)
 
     def on_batch_execute(self):
-        self._exec_threaded(self._batch_execute)
+        self._exec_threaded(self._batch_execute, self._validate_and_get_inputs())
+
+    def on_recheck_execute(self):
+        self._exec_threaded(self._batch_execute, self._validate_and_get_inputs(), True)
 
     def on_hub_execute(self):
-        self._exec_threaded(self._hub_execute)
+        self._exec_threaded(self._hub_execute, self._validate_and_get_inputs(check_ap=False))
 
     def on_ap_execute(self):
-        self._exec_threaded(self._ap_execute)
+        self._exec_threaded(self._ap_execute, self._validate_and_get_inputs(check_hub=False))
 
     def _validate_and_get_inputs(self, check_ap=True, check_hub=True):
         """入力フォームの値を検証し、辞書として返す。失敗時はNoneを返す。"""
@@ -402,7 +944,7 @@ class LineTabFrame(ctk.CTkFrame):
             self.mainapp.append_log(f"回線#{self.number}: IPアドレスまたはホスト名が入力されていません", level="warn")
             return None
         
-        inputs = {"ip": ip}
+        inputs = {"ip": ip, "line": self.number, "name": f"回線#{self.number}"}
         try:
             if check_hub:
                 inputs["hub_count"] = int(self.hub_count_entry.get())
@@ -427,202 +969,230 @@ class LineTabFrame(ctk.CTkFrame):
             self.mainapp.append_log(f"回線#{self.number}: 台数または開始番号に数字でない値が入力されています", level="warn")
             return None
 
-    # --- 変更点4：並列処理を行うように大幅に修正 ---
-    # --- 変更点：ログの表示順を担保するように修正 ---
-    def _perform_connectivity_checks(self, ip, base_port, count, start_num, device_name, success_level, success_list, timeout_sec):
-        """指定された機器群への疎通確認をまとめて実行し、結果をソートしてログ出力する"""
-        success_list.clear()
-        mode = self.mainapp.access_mode.get()
-        
-        # --- 処理結果を一時的に保存するリスト ---
-        results_buffer = []
-
-        urls_to_check = []
-        for i in range(count):
-            port = base_port + start_num + i
-            if not (0 < port < 65536):
-                self.mainapp.append_log(f"回線#{self.number}: {device_name}ポート不正: {port}", level="warn")
-                continue
-            urls_to_check.append(f"http://{ip}:{port}")
-        
-        if not urls_to_check:
-            return 0, 0
-
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_url = {executor.submit(self._check_connection, url, timeout_sec): url for url in urls_to_check}
-            
-            total_tasks = len(urls_to_check)
-            completed_tasks = 0
-
-            for future in as_completed(future_to_url):
-                if self.mainapp.stop_event.is_set():
-                    break 
-
-                url = future_to_url[future]
-                try:
-                    is_success, received_url = future.result()
-                    # --- ログ出力せず、結果をバッファに保存 ---
-                    results_buffer.append({'url': received_url, 'success': is_success, 'error': None})
-                except Exception as exc:
-                    # --- エラーもバッファに保存 ---
-                    results_buffer.append({'url': url, 'success': False, 'error': exc})
-                
-                completed_tasks += 1
-                self.mainapp.update_progress(completed_tasks / total_tasks)
-        
-        # --- 処理完了後、URLでソート ---
-        results_buffer.sort(key=lambda r: r['url'])
-
-        success_count = 0
-        fail_count = 0
-
-        # --- ソートした結果を順番にログ出力 ---
-        for result in results_buffer:
-            if result['success']:
-                success_count += 1
-                success_list.append(result['url'])
-                self.mainapp.append_log(f"回線#{self.number}: {device_name} 成功: {result['url']}", level=success_level)
-                if mode == "browser":
-                    open_url_in_chrome_force_tab(result['url'], self.mainapp)
-            else:
-                fail_count += 1
-                if result['error']:
-                    self.mainapp.append_log(f"回線#{self.number}: {device_name} エラー: {result['url']} ({result['error']})", level="fail")
-                else:
-                    self.mainapp.append_log(f"回線#{self.number}: {device_name} 失敗: {result['url']}", level="fail")
-
-        return success_count, fail_count
-
-
-    def _batch_execute(self):
-        inputs = self._validate_and_get_inputs()
-        if not inputs:
+    # --- 疎通確認の本体は probe_engine.ProbeEngine に移動。GUIは結果の表示のみ行う ---
+    def _line_log(self, message, level="info"):
+        self.mainapp.append_log(f"回線#{self.number}: {message}", level=level)
+
+    def _create_engine(self, token, settings, **overrides):
+        options = dict(
+            settings["engine_options"],
+            metrics_dir=METRICS_DIR,
+            stop_event=token,
+            on_log=self._line_log,
+            progress=self.mainapp.progress_for(token),
+        )
+        options.update(overrides)
+        return create_engine(settings["engine_kind"], **options)
+
+    def _on_phase(self, browser_urls, ip, device, state):
+        """エンジンのフェーズ開始・終了に合わせてステータス表示を更新する
+
+        RT/HUB/AP は同時に開始され、終わった順に "done" が届く。
+        ブラウザで開くURLは browser_urls に集め、実行の最後にまとめて開く（ブラウザを使わない場合は None）。
+        """
+        if device == DEVICE_RT:
+            if state == "start" and browser_urls is not None:
+                browser_urls.append(f"http://{ip}:{RT_HUB_BASE_PORT}")
             return
 
-        self.mainapp.set_log_marker("⚙️ 一括実行中...", "#FFEB3B")
-        self.mainapp.update_progress(0.0)
-
-        # --- RT ---
-        rt_url = f"http://{inputs['ip']}:{RT_HUB_BASE_PORT}"
-        rt_success_count, rt_fail_count = 0, 0
-        if self.mainapp.access_mode.get() == "browser":
-            open_url_in_chrome_force_tab(rt_url, self.mainapp)
-        is_rt_success, _ = self._check_connection(rt_url, timeout_sec=inputs["ap_timeout"])
-        if is_rt_success:
-            rt_success_count = 1
-            self.mainapp.append_log(f"回線#{self.number}: RT 成功: {rt_url}", level="rt_success")
+        status_var = self.hub_status_var if device == DEVICE_HUB else self.ap_status_var
+        if state == "start":
+            (self.success_hub_urls if device == DEVICE_HUB else self.success_ap_urls).clear()
+            self._set_status(status_var, f"{device}実行中...")
         else:
-            rt_fail_count = 1
-            self.mainapp.append_log(f"回線#{self.number}: RT 失敗: {rt_url}", level="fail")
-        
-        if self.mainapp.stop_event.is_set(): return
-
-        # --- HUB ---
-        self.hub_status_var.set("HUB実行中...")
-        self.mainapp.update_progress(0)
-        hub_success_count, hub_fail_count = self._perform_connectivity_checks(
-            inputs["ip"], RT_HUB_BASE_PORT, inputs["hub_count"], inputs["hub_start"],
-            "HUB", "hub_success", self.success_hub_urls,
-            timeout_sec=inputs["hub_timeout"]
-        )
-        self.hub_status_var.set("HUB完了")
-        
-        if self.mainapp.stop_event.is_set(): return
-
-        # --- AP ---
-        self.ap_status_var.set("AP実行中...")
-        self.mainapp.update_progress(0)
-        ap_success_count, ap_fail_count = self._perform_connectivity_checks(
-            inputs["ip"], AP_BASE_PORT, inputs["ap_count"], inputs["ap_start"],
-            "AP", "success", self.success_ap_urls,
-            timeout_sec=inputs["ap_timeout"]
+            self._set_status(status_var, f"{device}完了")
+
+    def _log_result(self, browser_urls, device, result):
+        """結果を1件ログ出力し、成功URLを保持する
+
+        エンジンからはポート順に、手前のポートが確定した時点で届くため、
+        速く応答したポートはフェーズの完了を待たずに表示される。
+        """
+        retry_note = f"（再試行{result.attempts - 1}回）" if result.attempts > 1 else ""
+        # 他の回線・実行で同時に確認していたポートは、その結果を共有している
+        retry_note += "（共有）" if result.coalesced else ""
+        if result.success:
+            success_level = {DEVICE_RT: "rt_success", DEVICE_HUB: "hub_success", DEVICE_AP: "success"}[device]
+            cache_note = "（キャッシュ）" if result.from_cache else ""
+            self._line_log(f"{device} 成功: {result.url}{cache_note}{retry_note}", level=success_level)
+            success_list = {DEVICE_HUB: self.success_hub_urls, DEVICE_AP: self.success_ap_urls}.get(device)
+            if success_list is None:
+                return
+            success_list.append(result.url)
+            # キャッシュから流用した成功URLはブラウザで開き直さない
+            if browser_urls is not None and not result.from_cache:
+                browser_urls.append(result.url)
+        elif result.error:
+            self._line_log(f"{device} エラー: {result.url} ({result.error}){retry_note}", level="fail")
+        else:
+            self._line_log(f"{device} 失敗: {result.url}{retry_note}", level="fail")
+
+    def _run_site(self, token, inputs, settings, mode, **kwargs):
+        """エンジンで1拠点分を実行し、成功したURLを1回のブラウザ起動でまとめて開く"""
+        browser_urls = [] if settings["browser"] else None
+        sweep = self._create_engine(token, settings).run_site(
+            inputs, mode, functools.partial(self._on_phase, browser_urls, inputs["ip"]),
+            on_result=functools.partial(self._log_result, browser_urls), **kwargs
         )
-        self.ap_status_var.set("AP完了")
+        if browser_urls and not sweep.stopped:
+            open_urls_in_chrome(browser_urls, self.mainapp, settings["tab_limit"])
+        return sweep
+
+    def _finish_stopped(self):
+        """緊急停止で中断した実行の表示を元に戻す"""
+        self.mainapp.set_log_marker("⛔ 停止しました", "#E57373")
+        time.sleep(1)
+        self.mainapp.clear_log_marker()
+        self._set_status(self.hub_status_var, "")
+        self._set_status(self.ap_status_var, "")
+
+    def _batch_execute(self, token, inputs, settings, recheck_failures=False):
+        if recheck_failures:
+            self.mainapp.set_log_marker("⚙️ 失敗のみ再確認中...", "#FFEB3B")
+            if not len(self.result_cache):
+                self._line_log("キャッシュされた結果がないため、全ポートを確認します", level="info")
+        else:
+            self.mainapp.set_log_marker("⚙️ 一括実行中...", "#FFEB3B")
+
+        sweep = self._run_site(token, inputs, settings, MODE_BATCH,
+                               cache=self.result_cache, recheck_failures=recheck_failures)
+        if sweep.stopped:
+            self._finish_stopped()
+            return
+        self.mainapp.set_slow_ports(self.number, slowest_ports(sweep))
 
         # --- Summary & Cleanup ---
-        self.mainapp.update_progress(1.0)
-        self.mainapp.append_log(f"回線#{self.number}: RT 成功 {rt_success_count}件 / 失敗 {rt_fail_count}件", level="summary_rt")
-        self.mainapp.append_log(f"回線#{self.number}: HUB 成功 {hub_success_count}件 / 失敗 {hub_fail_count}件", level="summary_hub")
-        self.mainapp.append_log(f"回線#{self.number}: AP 成功 {ap_success_count}件 / 失敗 {ap_fail_count}件", level="summary_ap")
+        for device, level in ((DEVICE_RT, "summary_rt"), (DEVICE_HUB, "summary_hub"), (DEVICE_AP, "summary_ap")):
+            success_count, fail_count = sweep.counts(device)
+            cached_count = sweep.cached_count(device)
+            cache_note = f"（うちキャッシュ {cached_count}件）" if cached_count else ""
+            retry_count = sweep.retry_count(device)
+            retry_note = f" / 再試行 {retry_count}回" if retry_count else ""
+            coalesced_count = sweep.coalesced_count(device)
+            coalesced_note = f" / 他の確認と共有 {coalesced_count}件" if coalesced_count else ""
+            self._line_log(f"{device} 成功 {success_count}件{cache_note} / 失敗 {fail_count}件{retry_note}{coalesced_note}",
+                           level=level)
+        start, end = sweep.concurrency
+        change = f"{start}→{end}" if start != end else f"{end}"
+        self._line_log(f"同時実行数 {change}", level="info")
 
         self.mainapp.set_log_marker("✅ 完了", "#00E676")
         time.sleep(1.1)
         self.mainapp.clear_log_marker()
-        self.mainapp.update_progress(0.0)
-        self.hub_status_var.set("")
-        self.ap_status_var.set("")
+        self._set_status(self.hub_status_var, "")
+        self._set_status(self.ap_status_var, "")
 
-    def _hub_execute(self):
-        inputs = self._validate_and_get_inputs(check_ap=False)
-        if not inputs:
-            return
-            
+    def _hub_execute(self, token, inputs, settings):
         self.mainapp.set_log_marker("⚙️ HUBアクセス中...", "#FFEB3B")
-        self.mainapp.update_progress(0.0)
-        self.hub_status_var.set("HUB実行中...")
-
-        # --- RT ---
-        rt_url = f"http://{inputs['ip']}:{RT_HUB_BASE_PORT}"
-        if self.mainapp.access_mode.get() == "browser":
-            open_url_in_chrome_force_tab(rt_url, self.mainapp)
-        is_rt_success, _ = self._check_connection(rt_url, timeout_sec=inputs["hub_timeout"])
-        if is_rt_success:
-            self.mainapp.append_log(f"回線#{self.number}: RT 成功: {rt_url}", level="rt_success")
-        else:
-            self.mainapp.append_log(f"回線#{self.number}: RT 失敗: {rt_url}", level="fail")
-        
-        if self.mainapp.stop_event.is_set(): return
+        self._set_status(self.hub_status_var, "HUB実行中...")
 
-        # --- HUB ---
-        self._perform_connectivity_checks(
-            inputs["ip"], RT_HUB_BASE_PORT, inputs["hub_count"], inputs["hub_start"],
-            "HUB", "hub_success", self.success_hub_urls,
-            timeout_sec=inputs["hub_timeout"]
-        )
+        sweep = self._run_site(token, inputs, settings, MODE_HUB, cache=self.result_cache)
+        if sweep.stopped:
+            self._finish_stopped()
+            return
+        self.mainapp.set_slow_ports(self.number, slowest_ports(sweep))
 
-        self.mainapp.update_progress(1.0)
-        self.hub_status_var.set("HUB完了")
+        self._set_status(self.hub_status_var, "HUB完了")
         self.mainapp.set_log_marker("✅ HUB完了", "#00E676")
         time.sleep(1)
         self.mainapp.clear_log_marker()
-        self.mainapp.update_progress(0.0)
-        self.hub_status_var.set("")
-
-    def _ap_execute(self):
-        inputs = self._validate_and_get_inputs(check_hub=False)
-        if not inputs:
-            return
+        self._set_status(self.hub_status_var, "")
 
+    def _ap_execute(self, token, inputs, settings):
         self.mainapp.set_log_marker("⚙️ APアクセス中...", "#FFEB3B")
-        self.mainapp.update_progress(0.0)
-        self.ap_status_var.set("AP実行中...")
+        self._set_status(self.ap_status_var, "AP実行中...")
 
-        self._perform_connectivity_checks(
-            inputs["ip"], AP_BASE_PORT, inputs["ap_count"], inputs["ap_start"],
-            "AP", "success", self.success_ap_urls,
-            timeout_sec=inputs["ap_timeout"]
-        )
+        sweep = self._run_site(token, inputs, settings, MODE_AP, cache=self.result_cache)
+        if sweep.stopped:
+            self._finish_stopped()
+            return
+        self.mainapp.set_slow_ports(self.number, slowest_ports(sweep))
         
-        self.mainapp.update_progress(1.0)
-        self.ap_status_var.set("AP完了")
+        self._set_status(self.ap_status_var, "AP完了")
         self.mainapp.set_log_marker("✅ AP完了", "#00E676")
         time.sleep(1)
         self.mainapp.clear_log_marker()
-        self.mainapp.update_progress(0.0)
-        self.ap_status_var.set("")
+        self._set_status(self.ap_status_var, "")
+
+    def toggle_monitor(self):
+        # トークンとボタンの切り替えは Tkスレッドで行う（ワーカー側で行うと、ダブルクリックで監視が2本始まる）
+        if self.monitor_token is not None:
+            self.monitor_token.cancel()
+            return
+        inputs = self._validate_and_get_inputs()
+        if not inputs:
+            return
+        try:
+            interval_sec = float(self.monitor_interval_entry.get())
+        except ValueError:
+            self._line_log(f"監視間隔の値が不正です。デフォルト値({MONITOR_INTERVAL_SEC}秒)を使用", level="warn")
+            interval_sec = MONITOR_INTERVAL_SEC
+        self.monitor_token = self._exec_threaded(self._monitor_execute, inputs, interval_sec, background=True)
+        self.monitor_btn.configure(text="監視停止", fg_color="#C62828", hover_color="#B71C1C")
+
+    def _monitor_stopped(self, token):
+        """監視の終了を反映する（Tkスレッドで呼ぶ）"""
+        if self.monitor_token is token:
+            self.monitor_token = None
+            self.monitor_btn.configure(text="監視開始", fg_color="#7E57C2", hover_color="#5E35B1")
+
+    def _monitor_log(self, message, level="info"):
+        # 監視中は確認のたびに出る定常ログを省き、警告以上だけを表示する
+        if level != "info":
+            self._line_log(message, level)
+
+    def _on_monitor_change(self, result, previous_up):
+        if result.success:
+            message, level, color = f"{result.device} 応答あり: {result.url}", "success", "#00E676"
+        else:
+            message, level, color = f"{result.device} 応答なし: {result.url}", "fail", "#E57373"
+        self._line_log(f"[監視] {message}", level=level)
+        self.mainapp.notify(f"回線#{self.number} {message}", color)
+
+    def _monitor_execute(self, token, inputs, settings, interval_sec):
+        try:
+            # 監視では実行ごとのメトリクスファイルを書き出さない（長時間の監視でファイルが増え続けるため）
+            engine = self._create_engine(token, settings, metrics_dir=None, on_log=self._monitor_log)
+            Monitor(engine, inputs, interval_sec=interval_sec,
+                    on_change=self._on_monitor_change, on_log=self._line_log).run()
+        finally:
+            self.mainapp.call_on_ui(self._monitor_stopped, token)
+
+    def show_last_responses(self):
+        """入力中の RT/HUB/AP の各ポートが最後に応答した日時を履歴から表示する"""
+        history = self.mainapp.history
+        if history is None:
+            self._line_log("履歴DBが使えないため照会できません", level="warn")
+            return
+        inputs = self._validate_and_get_inputs()
+        if not inputs:
+            return
+
+        ip = inputs["ip"]
+        targets = [(DEVICE_RT, RT_HUB_BASE_PORT)]
+        targets += [(DEVICE_HUB, port) for _, port, _ in build_targets(
+            ip, RT_HUB_BASE_PORT, inputs["hub_count"], inputs["hub_start"], DEVICE_HUB)]
+        targets += [(DEVICE_AP, port) for _, port, _ in build_targets(
+            ip, AP_BASE_PORT, inputs["ap_count"], inputs["ap_start"], DEVICE_AP)]
+        for device, port in targets:
+            responded = history.last_success(ip, port)
+            if responded is None:
+                self._line_log(f"{device} http://{ip}:{port} 最終応答: 記録なし", level="warn")
+            else:
+                self._line_log(f"{device} http://{ip}:{port} 最終応答: {responded['checked_at']:%Y/%m/%d %H:%M:%S}", level="info")
 
     def copy_success_hub_urls(self):
         if not self.success_hub_urls:
             self.mainapp.append_log(f"回線#{self.number}: コピー対象URLなし", level="warn")
             return
-        pyperclip.copy("\n".join(self.success_hub_urls))
+        copy_to_clipboard("\n".join(self.success_hub_urls))
         self.mainapp.append_log(f"回線#{self.number}: 成功URLコピー完了（{len(self.success_hub_urls)}件）", level="cleared")
 
     def copy_success_ap_urls(self):
         if not self.success_ap_urls:
             self.mainapp.append_log(f"回線#{self.number}: コピー対象URLなし", level="warn")
             return
-        pyperclip.copy("\n".join(self.success_ap_urls))
+        copy_to_clipboard("\n".join(self.success_ap_urls))
         self.mainapp.append_log(f"回線#{self.number}: 成功URLコピー完了（{len(self.success_ap_urls)}件）", level="cleared")
 
 
@@ -761,7 +1331,7 @@ class TemplateGeneratorFrame(ctk.CTkFrame):
         text_to_copy = self.output_textbox.get("1.0", "end-1c")
         if not text_to_copy:
             return
-        pyperclip.copy(text_to_copy)
+        copy_to_clipboard(text_to_copy)
         
         original_text = self.copy_button.cget("text")
         self.copy_button.configure(text="コピー完了！", state="disabled", fg_color="#66BB6A")
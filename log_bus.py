@@ -0,0 +1,58 @@
+"""ワーカースレッドから GUI へログを渡すためのキュー
+
+ワーカースレッドは push() でレコードを積むだけで、Tk のウィジェットには触らない。
+Tk スレッドが after() のタイマーで drain() を呼び、まとめて画面に反映する。
+全履歴は日付ごとのログファイル（ディスク）に残す（画面には LOG_MAX_VISIBLE_LINES 行まで）。
+"""
+import os
+import queue
+from datetime import datetime
+
+LOG_DRAIN_MAX = 5000  # 1回の drain() で取り出す最大件数（UIを固めないため）
+LOG_DIR = "logs"
+
+
+class LogBus:
+    def __init__(self, log_dir=LOG_DIR):
+        self._queue = queue.SimpleQueue()
+        self.log_dir = log_dir
+        self._file = None
+        self._file_date = None
+
+    def push(self, line, tag="info"):
+        """任意のスレッドから呼べる"""
+        self._queue.put((line, tag))
+
+    def drain(self, limit=LOG_DRAIN_MAX):
+        """溜まっているレコードを最大 limit 件取り出し、ファイルに書いてから返す"""
+        batch = []
+        try:
+            while len(batch) < limit:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
+            self._write(batch)
+        return batch
+
+    def _write(self, batch):
+        if not self.log_dir:
+            return
+        today = datetime.now().strftime("%Y%m%d")
+        try:
+            if self._file is None or self._file_date != today:
+                self.close()
+                os.makedirs(self.log_dir, exist_ok=True)
+                self._file = open(os.path.join(self.log_dir, f"PingAccess_{today}.log"), "a", encoding="utf-8")
+                self._file_date = today
+            self._file.write("".join(line for line, _ in batch))
+            self._file.flush()
+        except OSError:
+            # ディスクに書けなくても画面表示は続ける
+            self.close()
+            self.log_dir = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,279 @@
+"""疎通確認エンジンのベンチマーク
+
+127.0.0.1 の 50000/60000 番台に RT/HUB/AP の代わりになるローカルサーバーを立て、
+エンジン・同時実行数・タイムアウトの組み合わせごとに一括実行の速さを計測する。
+結果は JSON のレポートに出力するので、リリース前に前回の値と比べて劣化に気づける。
+
+サーバーの種類:
+    healthy   すぐに 200 を返す
+    slow      SLOW_DELAY_SEC 待ってから 200 を返す
+    blackhole 接続は受け付けるが何も返さない
+    refused   待ち受けていない（接続拒否）
+    large     LARGE_BODY_BYTES の本文を返す
+
+例:
+    python probe_bench.py --profile mixed --engines thread,asyncio --workers 10,40 -o bench_report.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from probe_engine import (
+    AP_BASE_PORT, DEFAULT_PROBE_METHOD, ENGINE_ASYNC, MODE_BATCH, PROBE_METHODS, RT_HUB_BASE_PORT, ENGINES, create_engine, make_site,
+)
+from probe_ratelimit import RATE_LIMIT_BURST, RateLimiter
+from probe_rtt import RttTracker, percentile
+from probe_scheduler import ProbeScheduler
+
+HEALTHY = "healthy"
+SLOW = "slow"
+BLACKHOLE = "blackhole"
+REFUSED = "refused"
+LARGE = "large"
+PROFILES = (HEALTHY, SLOW, BLACKHOLE, REFUSED, LARGE)
+MIXED = "mixed"
+MIXED_CYCLE = (HEALTHY, HEALTHY, SLOW, BLACKHOLE, REFUSED, LARGE)
+
+SLOW_DELAY_SEC = 0.5
+LARGE_BODY_BYTES = 2 * 1024 * 1024
+BENCH_HOST = "127.0.0.1"
+# 開発機で動いている他のサービスとぶつからないよう、HUB/AP は末尾番号 1000 から使う
+BENCH_START_NUM = 1000
+SAMPLE_INTERVAL_SEC = 0.01
+
+
+class StandInServers:
+    """ポートごとに種類を決めたローカルサーバー群を、1本のイベントループのスレッドで動かす"""
+
+    def __init__(self, port_profiles, host=BENCH_HOST):
+        self.port_profiles = port_profiles
+        self.host = host
+        self.unavailable = []  # 他のプロセスが使っていて立てられなかったポート
+        self._loop = asyncio.new_event_loop()
+        self._servers = []
+        self._handlers = set()  # 接続中のハンドラーのタスク（終了時に取り消す）
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="bench-servers")
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        # 無応答・遅延のサーバーは接続を持ったままなので、ループを止める前にハンドラーを片付ける
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _shutdown(self):
+        for server in self._servers:
+            server.close()
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+
+    async def _start(self):
+        for port, profile in self.port_profiles.items():
+            if profile == REFUSED:
+                continue
+            try:
+                server = await asyncio.start_server(
+                    lambda r, w, p=profile: self._track(self._handle(r, w, p)), self.host, port, backlog=512
+                )
+            except OSError:
+                self.unavailable.append(port)
+                continue
+            self._servers.append(server)
+
+    def _track(self, handler):
+        task = asyncio.ensure_future(handler)
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+        return task
+
+    @staticmethod
+    async def _handle(reader, writer, profile):
+        try:
+            if profile == BLACKHOLE:
+                # 相手が切断するまで読み捨てるだけで何も返さない
+                while await reader.read(4096):
+                    pass
+                return
+            request = await reader.readuntil(b"\r\n\r\n")
+            if profile == SLOW:
+                await asyncio.sleep(SLOW_DELAY_SEC)
+            body = b"x" * LARGE_BODY_BYTES if profile == LARGE else b"<html>ok</html>"
+            head = b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % len(body)
+            writer.write(head if request.startswith(b"HEAD ") else head + body)
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+
+def build_port_profiles(profile, hub_count, ap_count):
+    """RT・HUB・AP の各ポートにサーバーの種類を割り当てる"""
+    ports = [RT_HUB_BASE_PORT]
+    ports += [RT_HUB_BASE_PORT + BENCH_START_NUM + i for i in range(hub_count)]
+    ports += [AP_BASE_PORT + BENCH_START_NUM + i for i in range(ap_count)]
+    port_profiles = {}
+    for index, port in enumerate(ports):
+        if profile == MIXED:
+            # RT は常に正常にして、適応タイムアウトの基準になるようにする
+            port_profiles[port] = HEALTHY if index == 0 else MIXED_CYCLE[index % len(MIXED_CYCLE)]
+        else:
+            port_profiles[port] = profile
+    return port_profiles
+
+
+class _PeakThreads:
+    """計測中のスレッド数の最大値を一定間隔で記録する"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL_SEC):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_case(engine_kind, workers, timeout_sec, hub_count, ap_count, prescan, adaptive, probe_method):
+    """1つの組み合わせで一括実行を1回行い、計測結果の辞書を返す"""
+    baseline_threads = threading.active_count()
+    # asyncio エンジンはスケジューラーを使わず max_in_flight 件まで同時に待ち受けるため、そちらも workers にそろえる
+    options = {"max_in_flight": workers} if engine_kind == ENGINE_ASYNC else {}
+    engine = create_engine(
+        engine_kind, max_workers=workers, probe_method=probe_method, **options,
+        prescan=prescan, adaptive=adaptive,
+        # 組み合わせ同士が影響しないよう、スケジューラーと RTT の計測結果は毎回作り直す。
+        # エンジン自体の性能を測るため、接続レートの制限はせず、同時実行数は workers に固定する
+        scheduler=ProbeScheduler(max_workers=workers, per_run=workers, per_host=workers,
+                                 rate_limiter=RateLimiter(None, RATE_LIMIT_BURST)),
+        rtt_tracker=RttTracker(), adaptive_concurrency=False,
+    )
+    site = make_site(
+        BENCH_HOST, hub_count=hub_count, hub_start=BENCH_START_NUM, hub_timeout=timeout_sec,
+        ap_count=ap_count, ap_start=BENCH_START_NUM, ap_timeout=timeout_sec,
+    )
+
+    tracemalloc.start()
+    with _PeakThreads() as threads:
+        started = time.perf_counter()
+        sweep = engine.run_site(site, MODE_BATCH)
+        wall = time.perf_counter() - started
+    _, peak_mem = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = list(sweep.all_results())
+    latencies = [r.elapsed * 1000 for r in results]
+    success = sum(1 for r in results if r.success)
+    return {
+        "engine": engine_kind,
+        "workers": workers,
+        "effective_concurrency": engine.max_in_flight if engine_kind == ENGINE_ASYNC else engine.max_workers,
+        "timeout_sec": timeout_sec,
+        "prescan": prescan,
+        "adaptive": adaptive,
+        "probe_method": probe_method,
+        "probes": len(results),
+        "success": success,
+        "fail": len(results) - success,
+        "wall_sec": round(wall, 3),
+        "throughput_per_sec": round(len(results) / wall, 1) if wall else None,
+        "p50_ms": round(percentile(latencies, 0.5), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 1) if latencies else None,
+        "peak_threads": threads.peak - baseline_threads,
+        "peak_mem_kb": round(peak_mem / 1024, 1),
+    }
+
+
+def _csv_list(cast):
+    return lambda text: [cast(v) for v in text.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="疎通確認エンジンのベンチマーク")
+    parser.add_argument("--profile", choices=PROFILES + (MIXED,), default=MIXED, help="ローカルサーバーの種類")
+    parser.add_argument("--hub-count", type=int, default=10)
+    parser.add_argument("--ap-count", type=int, default=60)
+    parser.add_argument("--engines", type=_csv_list(str), default=list(ENGINES), help="カンマ区切り")
+    parser.add_argument("--workers", type=_csv_list(int), default=[10], help="カンマ区切り")
+    parser.add_argument("--timeouts", type=_csv_list(float), default=[1.0], help="カンマ区切り（秒）")
+    parser.add_argument("--probe", choices=PROBE_METHODS, default=DEFAULT_PROBE_METHOD, help="プローブ方式")
+    parser.add_argument("--no-prescan", dest="prescan", action="store_false")
+    parser.add_argument("--no-adaptive", dest="adaptive", action="store_false")
+    parser.add_argument("--repeat", type=int, default=1, help="組み合わせごとの実行回数")
+    parser.add_argument("-o", "--output", help="レポートの出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    unknown = [e for e in args.engines if e not in ENGINES]
+    if unknown:
+        parser.error(f"不明なエンジン: {', '.join(unknown)}")
+
+    port_profiles = build_port_profiles(args.profile, args.hub_count, args.ap_count)
+    cases = []
+    with StandInServers(port_profiles) as servers:
+        if servers.unavailable:
+            print(f"使用中のため立てられなかったポート: {servers.unavailable}", file=sys.stderr)
+        for engine_kind in args.engines:
+            for workers in args.workers:
+                for timeout_sec in args.timeouts:
+                    for _ in range(args.repeat):
+                        case = run_case(engine_kind, workers, timeout_sec, args.hub_count, args.ap_count,
+                                        args.prescan, args.adaptive, args.probe)
+                        print(f"{engine_kind:8} workers={workers:<4} timeout={timeout_sec:<5} "
+                              f"{case['wall_sec']:.3f}秒 p50={case['p50_ms']}ms p99={case['p99_ms']}ms "
+                              f"threads+{case['peak_threads']} mem={case['peak_mem_kb']}KB", file=sys.stderr)
+                        cases.append(case)
+
+    report = {
+        "generated_at": datetime.now().strftime("%Y/%m/%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenario": {
+            "profile": args.profile,
+            "hub_count": args.hub_count,
+            "ap_count": args.ap_count,
+            "port_profiles": {str(port): profile for port, profile in port_profiles.items()},
+            "unavailable_ports": servers.unavailable,
+        },
+        "results": cases,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
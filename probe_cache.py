@@ -0,0 +1,58 @@
+"""疎通確認結果のキャッシュ
+
+(host, port) ごとに直近の結果を有効期限（TTL）付きで保持する。
+「失敗のみ再確認」では、期限内の成功結果をキャッシュから使い、
+失敗したポートと期限切れのポートだけを確認し直す。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_TTL_SEC = 600  # 成功結果を使い回す期間（秒）
+RESULT_CACHE_MAX_ENTRIES = 4096
+
+
+class ResultCache:
+    def __init__(self, ttl_sec=RESULT_CACHE_TTL_SEC, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (host, port) -> (記録時刻, ProbeResult)。古い順
+
+    def put(self, host, result):
+        key = (host, result.port)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), result)
+            # 上限を超えたら最も古いものから捨てる
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, host, port):
+        """期限内の結果があれば返す。期限切れの結果はここで捨てる"""
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            recorded_at, result = entry
+            if time.monotonic() - recorded_at > self.ttl_sec:
+                del self._entries[key]
+                return None
+            return result
+
+    def purge(self):
+        """期限切れの結果をまとめて捨て、捨てた件数を返す"""
+        cutoff = time.monotonic() - self.ttl_sec
+        with self._lock:
+            expired = [key for key, (recorded_at, _) in self._entries.items() if recorded_at < cutoff]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
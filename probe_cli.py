@@ -0,0 +1,203 @@
+"""疎通確認ツール CLI版
+
+ディスプレイのない環境（cron / 踏み台サーバー）から RT/HUB/AP の疎通確認を実行し、
+結果を JSON または CSV で出力する。結果は拠点が終わった順に書き出す。
+
+例:
+    python probe_cli.py 192.168.1.100 --ap-count 6 --format csv -o result.csv
+    python probe_cli.py site1.test.jp site2.test.jp --mode hub
+    python probe_cli.py --sites sites.tsv --format csv -o result.csv
+"""
+import argparse
+import json
+import sys
+import textwrap
+from itertools import chain
+
+from probe_engine import (
+    DEFAULT_HUB_TIMEOUT_SEC,
+    DEFAULT_PROBE_METHOD,
+    DEFAULT_RETRY_ATTEMPTS,
+    DEFAULT_TIMEOUT_SEC,
+    DEVICE_AP,
+    DEVICE_HUB,
+    DEVICE_RT,
+    ENGINE_THREAD,
+    ENGINES,
+    MAX_WORKERS,
+    MODE_BATCH,
+    MODES,
+    PROBE_METHODS,
+    RETRY_DEADLINE_SEC,
+    create_engine,
+    iter_sweeps,
+    make_retry_policies,
+    make_site,
+)
+from probe_concurrency import AIMD_MAX_LIMIT
+from probe_history import HistoryStore
+from probe_retry import RETRY_BACKOFF_SEC
+from probe_ratelimit import RATE_LIMIT_BURST, RATE_LIMIT_PER_SEC, RateLimiter
+from probe_scheduler import ProbeScheduler
+from probe_sitelist import SiteResultWriter, iter_site_file
+
+
+def parse_attempts(text):
+    """--attempts の値を、全機器共通の回数（int）か 機器種別 -> 回数 の辞書にする"""
+    text = text.strip()
+    try:
+        if "=" not in text:
+            return max(1, int(text))
+        attempts = {}
+        for item in text.split(","):
+            device, _, count = item.partition("=")
+            device = device.strip().upper()
+            if device not in (DEVICE_RT, DEVICE_HUB, DEVICE_AP):
+                raise ValueError(device)
+            attempts[device] = max(1, int(count))
+        return attempts
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"試行回数の指定が不正です: {text}（例: 3 または AP=3,HUB=2）") from None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="RT/HUB/AP 疎通確認（CLI版）")
+    parser.add_argument("hosts", nargs="*", help="IPアドレスまたはホスト名（複数指定可）")
+    parser.add_argument("--sites", metavar="FILE",
+                        help="拠点リスト（CSV / TSV、- で標準入力）。省略した列は下のオプションの値を使う")
+    parser.add_argument("--mode", choices=MODES, default=MODE_BATCH, help="実行モード（既定: batch）")
+    parser.add_argument("--hub-count", type=int, default=1, help="HUB台数")
+    parser.add_argument("--hub-start", type=int, default=1, help="HUB開始末尾番号")
+    parser.add_argument("--hub-timeout", type=float, default=DEFAULT_HUB_TIMEOUT_SEC, help="HUB最大待機時間（秒）")
+    parser.add_argument("--ap-count", type=int, default=6, help="AP台数")
+    parser.add_argument("--ap-start", type=int, default=1, help="AP開始末尾番号")
+    parser.add_argument("--ap-timeout", type=float, default=DEFAULT_TIMEOUT_SEC, help="AP最大待機時間（秒）")
+    parser.add_argument("--engine", choices=ENGINES, default=ENGINE_THREAD, help="疎通確認エンジン（既定: thread）")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="1拠点あたりの同時実行数（threadエンジン、自動調整が無効な場合）")
+    parser.add_argument("--parallel", type=int, default=4, help="同時に確認する拠点数")
+    parser.add_argument("--probe", choices=PROBE_METHODS, default=DEFAULT_PROBE_METHOD,
+                        help="プローブ方式（get: 本文まで受信 / head: HEAD / stream: ヘッダーのみ）")
+    parser.add_argument("--no-prescan", dest="prescan", action="store_false",
+                        help="TCP事前スキャンを行わず全ポートをHTTPで確認する")
+    parser.add_argument("--connect-timeout", type=float, default=None,
+                        help="TCP事前スキャンの待機時間（秒、省略時は各フェーズのタイムアウト）")
+    parser.add_argument("--no-adaptive", dest="adaptive", action="store_false",
+                        help="応答時間からタイムアウトを短縮せず、指定値をそのまま使う")
+    parser.add_argument("--no-adaptive-concurrency", dest="adaptive_concurrency", action="store_false",
+                        help="同時実行数を自動調整せず、--workers の値に固定する")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT_PER_SEC,
+                        help="1ホスト（RT）あたり毎秒の新規接続数の上限（0で制限なし）")
+    parser.add_argument("--burst", type=int, default=RATE_LIMIT_BURST, help="1ホストに一度に送ってよい接続数")
+    parser.add_argument("--attempts", type=parse_attempts, default=DEFAULT_RETRY_ATTEMPTS, metavar="N|DEVICE=N,...",
+                        help="失敗したポートの最大試行回数。全機器共通の回数か、AP=3,HUB=2 のように機器種別ごとに指定"
+                             "（省略した機器種別と既定は1で再試行なし）")
+    parser.add_argument("--retry-backoff", type=float, default=RETRY_BACKOFF_SEC,
+                        help="1回目の失敗後に待つ秒数（以降は倍々に延ばす）")
+    parser.add_argument("--retry-deadline", type=float, default=RETRY_DEADLINE_SEC,
+                        help="1回目の確認の開始からこの秒数を過ぎたら再試行しない")
+    parser.add_argument("--hedge", action="store_true",
+                        help="応答時間の p95 を過ぎても応答がない確認に2本目のリクエストを出す")
+    parser.add_argument("--history", metavar="DB", help="結果を保存する履歴DB（SQLite）のパス")
+    parser.add_argument("--metrics-dir", metavar="DIR",
+                        help="応答時間ヒストグラム（JSON / Prometheus textfile）の出力先ディレクトリ")
+    parser.add_argument("--format", choices=("json", "csv"), default="json", help="出力形式")
+    parser.add_argument("-o", "--output", help="出力先ファイル（省略時は標準出力）")
+    return parser
+
+
+def _failures(sweep):
+    return sum(sweep.counts(device)[1] for device in sweep.results)
+
+
+def write_json(sweeps, fp):
+    """拠点の結果を終わった順に JSON 配列の要素として書き出し、失敗件数の合計を返す
+
+    1拠点ずつ書き出して捨てるため、拠点が何百あってもメモリ使用量は増えない。
+    """
+    failures = 0
+    count = 0
+    # 拠点リストの読み込みに失敗した場合に中途半端な "[" を出さないよう、最初の拠点が終わってから書き始める
+    for sweep in sweeps:
+        text = json.dumps(sweep.to_dict(), ensure_ascii=False, indent=2)
+        fp.write(("," if count else "[") + "\n" + textwrap.indent(text, "  "))
+        fp.flush()
+        count += 1
+        failures += _failures(sweep)
+    fp.write("\n]\n" if count else "[]\n")
+    return failures
+
+
+def write_csv(sweeps, fp):
+    """拠点の結果を終わった順に CSV の行として書き出し、失敗件数の合計を返す"""
+    failures = 0
+    writer = SiteResultWriter(fp)
+    for sweep in sweeps:
+        writer.write(sweep)
+        failures += _failures(sweep)
+    return failures
+
+
+def _stderr_log(message, level="info"):
+    print(f"[{level}] {message}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.hosts and not args.sites:
+        parser.error("ホストまたは --sites を指定してください")
+    parallel = max(1, args.parallel)
+    # 全拠点で1つの同時実行枠を共有し、拠点間でラウンドロビンに実行する
+    history = HistoryStore(args.history) if args.history else None
+    per_site = AIMD_MAX_LIMIT if args.adaptive_concurrency else args.workers
+    scheduler = ProbeScheduler(max_workers=per_site * parallel, per_run=args.workers, per_host=args.workers,
+                               rate_limiter=RateLimiter(args.rate, args.burst))
+    retry_policies = make_retry_policies(args.attempts, backoff_sec=args.retry_backoff,
+                                         deadline_sec=args.retry_deadline)
+
+    def run_one(site):
+        engine = create_engine(
+            args.engine, max_workers=args.workers, probe_method=args.probe,
+            prescan=args.prescan, connect_timeout=args.connect_timeout, adaptive=args.adaptive,
+            retry_policies=retry_policies, hedge=args.hedge, adaptive_concurrency=args.adaptive_concurrency,
+            scheduler=scheduler, history=history, metrics_dir=args.metrics_dir, on_log=_stderr_log,
+        )
+        sweep = engine.run_site(site, mode=args.mode)
+        label = site.get("name") or site["ip"]
+        for device, results in sweep.results.items():
+            if results:
+                success, fail = sweep.counts(device)
+                _stderr_log(f"{label}: {device} 成功 {success}件 / 失敗 {fail}件 / 再試行 {sweep.retry_count(device)}回"
+                            f" / 共有 {sweep.coalesced_count(device)}件")
+        _stderr_log(f"{label}: 同時実行数 {sweep.concurrency[0]}→{sweep.concurrency[1]}")
+        return sweep
+
+    # 拠点リストは1行ずつ読み、拠点は終わった順に書き出す（全拠点の完了を待たない）
+    defaults = dict(hub_count=args.hub_count, hub_start=args.hub_start, hub_timeout=args.hub_timeout,
+                    ap_count=args.ap_count, ap_start=args.ap_start, ap_timeout=args.ap_timeout)
+    sites = (make_site(host, **defaults) for host in args.hosts)
+    if args.sites:
+        sites = chain(sites, iter_site_file(args.sites, defaults, _stderr_log))
+    sweeps = iter_sweeps(sites, run_one, parallel)
+    writer = write_csv if args.format == "csv" else write_json
+    try:
+        if args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as fp:
+                failures = writer(sweeps, fp)
+        else:
+            failures = writer(sweeps, sys.stdout)
+    except (OSError, ValueError) as e:
+        # 拠点リストが開けない・見出しが不正など
+        _stderr_log(f"実行を中断しました: {e}", "error")
+        return 2
+    finally:
+        if history is not None:
+            history.close()
+
+    # 失敗が1件でもあれば終了コード1（cron での監視用）。実行できなかった場合は2
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""ホストごとの同時実行数の自動調整（AIMD）
+
+LAN 直結の RT なら数十件を同時に確認しても問題ないが、LTE / SIM 回線の RT は
+ポートフォワーディング（NAT）の処理が追いつかず、同時に送りすぎると応答が返らなくなる。
+確認が1巡（その時点の同時実行数と同じ件数。ただし AIMD_ROUND_MAX 件まで）終わるたびに、
+
+- 応答待ちのタイムアウトが一定の割合を超えたら、同時実行数を半分にする（乗算的減少）
+- タイムアウトがなく応答時間も平常どおりなら、同時実行数を1増やす（加算的増加）
+
+混雑とみなすのは、一度でも応答したことのあるポートのタイムアウトだけで、1巡の中で同じポートは
+1回しか数えない（機器のないポートや、同じポートの再試行で同時実行数を下げないため）。
+1巡に満たないまま実行が終わった場合は、AIMD_ROUND_MIN 件以上あればその分で見直す（数ポートだけの拠点でも学習する）。
+学習した同時実行数はホストごとにファイルへ保存し、次回の実行はその値から始める。
+ただし減らした値は、続けて2巡以上混雑した場合にだけ保存する（1巡だけの一時的な混雑を次回に持ち越さない）。
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+CONCURRENCY_STATE_PATH = "concurrency_limits.json"
+AIMD_INITIAL_LIMIT = 10  # 学習値のないホストの同時実行数（従来の MAX_WORKERS と同じ）
+AIMD_MIN_LIMIT = 2
+AIMD_MAX_LIMIT = 40
+AIMD_INCREASE = 1
+AIMD_DECREASE = 0.5
+AIMD_TIMEOUT_RATE = 0.2  # 1巡のうちタイムアウトがこの割合以上なら減らす
+AIMD_LATENCY_FACTOR = 2.0  # 1巡の平均応答時間が平常時のこの倍率以下なら増やしてよい
+AIMD_BASELINE_DRIFT = 0.1  # 平常時の応答時間を、遅くなった1巡の平均にこの割合だけ寄せる（回線の変化に追従するため）
+AIMD_TIMEOUT_MARGIN = 0.9  # タイムアウト値のこの割合以上待って失敗した確認をタイムアウトとみなす
+AIMD_CONFIRM_ROUNDS = 2  # 続けてこの巡数だけ混雑したら、減らした同時実行数を保存する
+AIMD_ROUND_MAX = 8  # 1巡の件数の上限（同時実行数が大きくても、この件数ごとに見直す）
+AIMD_ROUND_MIN = 3  # 実行の終わりに1巡に満たない確認を見直しに使う最小件数
+
+
+class AimdLimit:
+    """1ホスト分の同時実行数"""
+
+    def __init__(self, limit=AIMD_INITIAL_LIMIT, baseline=None):
+        self.limit = float(limit)
+        self.baseline = baseline  # 平常時の応答時間（秒）。1巡ごとの平均応答時間から求める
+        self.saved_limit = self.current  # ファイルに保存する同時実行数
+        self._congested_rounds = 0  # 続けて混雑した巡数
+        self._count = 0
+        self._timeouts = 0
+        self._timed_out_ports = set()  # この巡でタイムアウトとして数えたポート
+        self._latency_sum = 0.0
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def observe(self, elapsed, timed_out, port=None):
+        """応答のあった確認（elapsed 秒）またはタイムアウトした確認を1件記録し、
+        1巡分たまったら同時実行数を見直す。見直したら True を返す
+
+        port を渡すと、この巡で既にタイムアウトとして数えたポートのタイムアウトは数えない。
+        """
+        if timed_out:
+            if port is not None and port in self._timed_out_ports:
+                return False
+            self._timed_out_ports.add(port)
+            self._timeouts += 1
+        else:
+            self._latency_sum += elapsed
+        self._count += 1
+        if self._count < max(1, min(self.current, AIMD_ROUND_MAX)):
+            return False
+        return self._evaluate()
+
+    def close_round(self):
+        """1巡に満たない確認を AIMD_ROUND_MIN 件以上記録していれば、その分で見直す。見直したら True を返す"""
+        if self._count < AIMD_ROUND_MIN:
+            return False
+        return self._evaluate()
+
+    def _evaluate(self):
+        answered = self._count - self._timeouts
+        mean = self._latency_sum / answered if answered else None
+        if self._timeouts / self._count >= AIMD_TIMEOUT_RATE:
+            self.limit = max(AIMD_MIN_LIMIT, self.limit * AIMD_DECREASE)
+            self._congested_rounds += 1
+            if self._congested_rounds >= AIMD_CONFIRM_ROUNDS:
+                self.saved_limit = self.current
+        else:
+            if mean is not None and (self.baseline is None or mean <= self.baseline * AIMD_LATENCY_FACTOR):
+                self.limit = min(AIMD_MAX_LIMIT, self.limit + AIMD_INCREASE)
+            self._congested_rounds = 0
+            # 確定していない（1巡だけの混雑による）減少は保存する値に反映しない
+            self.saved_limit = max(self.saved_limit, self.current)
+        if mean is not None:
+            if self.baseline is None or mean < self.baseline:
+                self.baseline = mean
+            else:
+                self.baseline += (mean - self.baseline) * AIMD_BASELINE_DRIFT
+        self._count = self._timeouts = 0
+        self._timed_out_ports.clear()
+        self._latency_sum = 0.0
+        return True
+
+
+class ConcurrencyController:
+    """ホストごとの AimdLimit を持ち、学習した同時実行数をファイルに保存する"""
+
+    def __init__(self, path=CONCURRENCY_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._limits = {}  # host -> AimdLimit
+        self._learned = set()  # ファイルから読み込んだか、1巡以上見直したホスト（limit_for だけでは増えない）
+        self._answered = {}  # host -> 一度でも応答したポートの集合
+        self._unconfirmed = {}  # host -> 応答したことのないままタイムアウトしたポートの集合
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fp:
+                saved = json.load(fp)
+            for host, entry in saved["hosts"].items():
+                baseline_ms = entry.get("baseline_ms")
+                self._limits[host] = AimdLimit(
+                    min(AIMD_MAX_LIMIT, max(AIMD_MIN_LIMIT, entry["limit"])),
+                    baseline_ms / 1000 if baseline_ms is not None else None,
+                )
+                self._learned.add(host)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # 壊れたファイルは使わず、初期値から学習し直す
+            self._limits.clear()
+            self._learned.clear()
+
+    def _entry(self, host):
+        entry = self._limits.get(host)
+        if entry is None:
+            entry = self._limits[host] = AimdLimit()
+        return entry
+
+    def limit_for(self, host):
+        with self._lock:
+            return self._entry(host).current
+
+    def is_learned(self, host):
+        with self._lock:
+            return host in self._learned
+
+    def observe(self, host, port, elapsed, timed_out):
+        """host:port の確認1件を記録する
+
+        一度も応答したことのないポートのタイムアウトは、機器がないだけかもしれないので保留しておき、
+        そのポートが後で（再試行などで）応答した時に初めて混雑として数える。
+        """
+        with self._lock:
+            entry = self._entry(host)
+            answered = self._answered.setdefault(host, set())
+            unconfirmed = self._unconfirmed.setdefault(host, set())
+            changed = False
+            if timed_out:
+                if port not in answered:
+                    unconfirmed.add(port)
+                    return
+                changed = entry.observe(elapsed, True, port)
+            else:
+                answered.add(port)
+                if port in unconfirmed:
+                    unconfirmed.discard(port)
+                    changed = entry.observe(elapsed, True, port)
+                changed = entry.observe(elapsed, False, port) or changed
+            if changed:
+                self._learned.add(host)
+                self._dirty = True
+
+    def close_round(self, host):
+        """実行の終わりに、host の1巡に満たない確認で同時実行数を見直す"""
+        with self._lock:
+            entry = self._limits.get(host)
+            if entry is not None and entry.close_round():
+                self._learned.add(host)
+                self._dirty = True
+
+    def save(self):
+        """学習値に変化があればファイルに書き出す"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            saved = {
+                "updated_at": datetime.now().strftime("%Y/%m/%d %H:%M:%S"),
+                "hosts": {
+                    host: {
+                        "limit": entry.saved_limit,
+                        "baseline_ms": round(entry.baseline * 1000, 1) if entry.baseline is not None else None,
+                    }
+                    for host, entry in self._limits.items()
+                },
+            }
+            # 書きかけのファイルを読まれないよう、一時ファイルから置き換える
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fp:
+                json.dump(saved, fp, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+
+_shared_controller = None
+_shared_lock = threading.Lock()
+
+
+def get_concurrency_controller():
+    """プロセス内で共有する ConcurrencyController を返す（回線タブをまたいで学習値を使う）"""
+    global _shared_controller
+    with _shared_lock:
+        if _shared_controller is None:
+            _shared_controller = ConcurrencyController()
+        return _shared_controller
@@ -0,0 +1,83 @@
+"""名前解決のキャッシュ
+
+IP/ホスト名欄にホスト名（xxxx.test.jp など）が入力された場合、ポートごとに名前解決すると
+遅い DNS サーバーでは待ち時間がポート数分積み重なる。実行の開始時に1回だけ解決し、
+結果を有効期限（TTL）付きで回線タブをまたいで共有する。各プローブは解決済みのアドレスに直接接続する。
+"""
+import ipaddress
+import socket
+import threading
+import time
+from collections import namedtuple
+
+DNS_CACHE_TTL_SEC = 300  # 解決結果を使い回す期間（秒）
+
+Resolution = namedtuple("Resolution", "address elapsed cached")
+
+
+def is_ip_literal(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class DnsCache:
+    def __init__(self, ttl_sec=DNS_CACHE_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._entries = {}  # host -> (記録時刻, アドレス)
+        self._host_locks = {}  # 同じ名前を同時に解決しないためのホストごとのロック
+
+    def lookup(self, host):
+        """期限内の解決結果があればアドレスを返す（名前解決は行わない）"""
+        if is_ip_literal(host):
+            return host
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                return None
+            recorded_at, address = entry
+            if time.monotonic() - recorded_at > self.ttl_sec:
+                del self._entries[host]
+                return None
+            return address
+
+    def resolve(self, host):
+        """host を解決して Resolution(アドレス, 解決にかかった秒数, キャッシュを使ったか) を返す
+
+        解決できない場合は OSError（socket.gaierror）を送出する。
+        """
+        if is_ip_literal(host):
+            return Resolution(host, 0.0, False)
+        with self._lock:
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+        # 他の回線が同じ名前を解決中なら、その結果を待って使う
+        with host_lock:
+            address = self.lookup(host)
+            if address is not None:
+                return Resolution(address, 0.0, True)
+            started = time.perf_counter()
+            address = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0][4][0]
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._entries[host] = (time.monotonic(), address)
+            return Resolution(address, elapsed, False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_dns_cache():
+    """プロセス内で共有する DnsCache を返す（回線タブをまたいで解決結果を使い回す）"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = DnsCache()
+        return _shared_cache
@@ -0,0 +1,1185 @@
+"""RT/HUB/AP 疎通確認エンジン（GUI 非依存）
+
+CustomTkinter を起動せずに疎通確認を実行するためのモジュール。
+GUI（PingAccessAutomationTool_v2.2.py）と CLI（probe_cli.py）の両方から利用する。
+"""
+import asyncio
+import copy
+import heapq
+import queue
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from itertools import islice
+from datetime import datetime
+
+from probe_concurrency import AIMD_MAX_LIMIT, AIMD_TIMEOUT_MARGIN, get_concurrency_controller
+from probe_dns import get_dns_cache, is_ip_literal
+from probe_metrics import write_run_metrics
+from probe_prescan import iter_tcp_prescan
+from probe_progress import ProgressModel
+from probe_retry import HEDGE_MIN_DELAY_SEC, RETRY_BACKOFF_SEC, RetryPolicy
+from probe_rtt import ADAPTIVE_MIN_TIMEOUT_SEC, RTT_SAFETY_FACTOR, get_rtt_tracker
+from probe_scheduler import get_scheduler
+from probe_singleflight import get_single_flight
+from probe_table import FLAG_COALESCED, FLAG_FROM_CACHE, PortTable
+
+MAX_WORKERS = 10 # 並列処理で同時に実行する最大タスク数（同時実行数の自動調整が無効な場合）
+
+# --- 疎通確認の設定定数 ---
+RT_HUB_BASE_PORT = 50000
+AP_BASE_PORT = 60000
+# デフォルトのタイムアウト値（入力が不正だった場合に使われる）
+DEFAULT_TIMEOUT_SEC = 3
+DEFAULT_HUB_TIMEOUT_SEC = 7
+
+# --- 機器種別 ---
+DEVICE_RT = "RT"
+DEVICE_HUB = "HUB"
+DEVICE_AP = "AP"
+
+# --- 実行モード（GUIの 一括実行 / HUB実行 / AP実行 に対応） ---
+MODE_BATCH = "batch"
+MODE_HUB = "hub"
+MODE_AP = "ap"
+MODE_RT = "rt"
+MODES = (MODE_BATCH, MODE_HUB, MODE_AP, MODE_RT)
+
+# --- エンジン種別（GUIの「エンジン」ラジオボタンに対応） ---
+ENGINE_THREAD = "thread"
+ENGINE_ASYNC = "asyncio"
+ENGINES = (ENGINE_THREAD, ENGINE_ASYNC)
+# asyncio エンジンで同時に待ち受ける最大プローブ数（1スレッドで処理する）
+MAX_ASYNC_IN_FLIGHT = 256
+
+# --- プローブ方式 ---
+# get: 従来どおり本文まで全て受信する
+# head: HEAD を送る（本文がないので接続をプールに戻して再利用できる）
+# stream: GET を送り、ステータス行とヘッダーを受け取った時点で接続を閉じる
+PROBE_GET = "get"
+PROBE_HEAD = "head"
+PROBE_STREAM = "stream"
+PROBE_METHODS = (PROBE_GET, PROBE_HEAD, PROBE_STREAM)
+DEFAULT_PROBE_METHOD = PROBE_STREAM
+
+# --- パイプラインの段（TCP事前スキャン → HTTP確認） ---
+STAGE_TCP = "tcp"
+STAGE_HTTP = "http"
+STAGE_LABELS = {STAGE_TCP: "TCP事前スキャン", STAGE_HTTP: "HTTP確認"}
+
+# 停止要求を確認する間隔（秒）。緊急停止はこの間隔以内に検知される
+STOP_POLL_SEC = 0.05
+# スケジューラーに積んでおくジョブ数の上限（同時実行数の何倍か）。残りのジョブは空きが出てから作る
+PIPELINE_WINDOW_FACTOR = 2
+_NO_MORE_JOBS = object()  # take_jobs() で jobs を使い切ったことを表す
+
+# --- 機器種別ごとの再試行ポリシー（HTTP 確認に失敗したポートだけが対象） ---
+# 応答のないポートは試行回数の分だけタイムアウトを待つことになるため、既定では再試行しない
+# （一括実行の所要時間を「最も遅い1件の確認」程度に保つ）。GUI の「試行回数」や CLI の --attempts で
+# 機器種別ごとに有効にする（起動途中や無線バックホールが混雑している AP は1回目に失敗しやすい）
+DEFAULT_RETRY_ATTEMPTS = 1
+RETRY_DEADLINE_SEC = 15
+
+
+def make_retry_policies(attempts=DEFAULT_RETRY_ATTEMPTS, backoff_sec=RETRY_BACKOFF_SEC, deadline_sec=RETRY_DEADLINE_SEC):
+    """機器種別ごとの再試行ポリシーを作る
+
+    attempts は全機器共通の最大試行回数か、機器種別 -> 最大試行回数 の辞書
+    （辞書にない機器種別は DEFAULT_RETRY_ATTEMPTS）。
+    """
+    if not isinstance(attempts, dict):
+        attempts = dict.fromkeys((DEVICE_RT, DEVICE_HUB, DEVICE_AP), attempts)
+    return {
+        device: RetryPolicy(attempts.get(device, DEFAULT_RETRY_ATTEMPTS), backoff_sec=backoff_sec,
+                            deadline_sec=deadline_sec)
+        for device in (DEVICE_RT, DEVICE_HUB, DEVICE_AP)
+    }
+
+
+DEFAULT_RETRY_POLICIES = make_retry_policies()
+
+
+
+class InflightSockets:
+    """応答待ち中のソケットを実行ごとに記録し、緊急停止時にまとめて切断する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = set()
+
+    def add(self, sock):
+        with self._lock:
+            self._sockets.add(sock)
+
+    def discard(self, sock):
+        with self._lock:
+            self._sockets.discard(sock)
+
+    def abort_all(self):
+        """記録中のソケットを shutdown し、待っているスレッドを即座に戻す。切断した数を返す"""
+        with self._lock:
+            sockets = list(self._sockets)
+            self._sockets.clear()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return len(sockets)
+
+
+def get_session(pool_size=MAX_WORKERS):
+    """同時実行数に合わせた接続プールを持つ共有 Session を返す
+
+    requests は読み込みに時間がかかるため、最初の確認の時点で probe_http を読み込む。
+    """
+    return _http().get_session(pool_size)
+
+
+def close_sessions():
+    """共有 Session を全て閉じる（アプリ終了時に呼ぶ。一度も確認していなければ何もしない）"""
+    probe_http = sys.modules.get("probe_http")
+    if probe_http is not None:
+        probe_http.close_sessions()
+
+
+def _http():
+    import probe_http
+    return probe_http
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class ProbeResult:
+    """1ポート分の疎通確認結果（インスタンスごとの __dict__ を持たないよう __slots__ で属性を固定する）
+
+    実行の結果として保持するのは probe_table.PortTable の配列で、ProbeResult は表示・集計の時に作り直す。
+    """
+
+    __slots__ = ("device", "url", "port", "success", "error", "elapsed", "stage", "timeout", "dns", "connect",
+                 "ttfb", "from_cache", "coalesced", "attempts", "hedged")
+
+    def __init__(self, device, url, port, success, error=None, elapsed=0.0, stage=STAGE_HTTP, timeout=None,
+                 timing=None):
+        timing = timing or {}
+        self.device = device
+        self.url = url
+        self.port = port
+        self.success = success
+        self.error = error
+        self.elapsed = elapsed
+        self.stage = stage  # 結果が確定した段（TCP事前スキャンで弾かれた場合は "tcp"）
+        self.timeout = timeout  # 実際に使った接続のタイムアウト（適応タイムアウトで短縮される。応答待ちは入力値のまま）
+        # 内訳（秒）。計測できなかった段は None（接続の再利用、TCP事前スキャンで弾かれた場合など）
+        self.dns = timing.get("dns")
+        self.connect = timing.get("connect")
+        self.ttfb = timing.get("ttfb")
+        self.from_cache = False  # 「失敗のみ再確認」でキャッシュから流用した結果
+        self.coalesced = False  # 他の回線・実行で同時に進んでいた同じポートの確認の結果を共有したもの
+        self.attempts = 1  # 結果が確定するまでの試行回数（ヘッジは含めない）
+        self.hedged = False  # ヘッジ（2本目の同時リクエスト）を出したか
+
+    def to_dict(self):
+        return {
+            "device": self.device,
+            "url": self.url,
+            "port": self.port,
+            "success": self.success,
+            "error": str(self.error) if self.error else None,
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+            "dns_ms": _ms(self.dns),
+            "connect_ms": _ms(self.connect),
+            "ttfb_ms": _ms(self.ttfb),
+            "stage": self.stage,
+            "timeout_sec": round(self.timeout, 3) if self.timeout is not None else None,
+            "from_cache": self.from_cache,
+            "coalesced": self.coalesced,
+            "attempts": self.attempts,
+            "hedged": self.hedged,
+        }
+
+
+class StageStats:
+    """パイプライン1段分の統計（対象数・通過数・所要時間）"""
+
+    def __init__(self, device, stage, timeout_sec):
+        self.device = device
+        self.stage = stage
+        self.timeout_sec = timeout_sec
+        self.total = 0
+        self.passed = 0
+        self.elapsed = 0.0
+
+    @property
+    def failed(self):
+        return self.total - self.passed
+
+    def describe(self):
+        return (f"{self.device} {STAGE_LABELS[self.stage]} {self.passed}/{self.total}件 通過 "
+                f"({self.elapsed:.2f}秒 / 上限{self.timeout_sec}秒)")
+
+    def to_dict(self):
+        return {
+            "device": self.device,
+            "stage": self.stage,
+            "timeout_sec": self.timeout_sec,
+            "total": self.total,
+            "passed": self.passed,
+            "failed": self.failed,
+            "elapsed_sec": round(self.elapsed, 3),
+        }
+
+
+class SweepResult:
+    """1拠点（1回線）分の実行結果。機器種別ごとに結果表（PortTable）を保持する"""
+
+    def __init__(self, site, mode):
+        self.run_id = uuid.uuid4().hex
+        self.site = site
+        self.address = None  # 名前解決したアドレス（解決できなかった場合は None）
+        self.mode = mode
+        self.results = {device: PortTable(device, site["ip"], (), ProbeResult)
+                        for device in (DEVICE_RT, DEVICE_HUB, DEVICE_AP)}
+        self.stages = []
+        self.stopped = False
+        self.stop_latency = None
+        self.started_at = datetime.now()
+        self.elapsed = 0.0
+        self.concurrency = None  # (開始時, 終了時) のホストへの同時実行数
+
+    def counts(self, device):
+        """(成功件数, 失敗件数) を返す"""
+        success, fail, _ = self.results[device].counts()
+        return success, fail
+
+    def cached_count(self, device):
+        """キャッシュから流用した結果の件数"""
+        return self.results[device].flag_count(FLAG_FROM_CACHE)
+
+    def coalesced_count(self, device):
+        """他の回線・実行の確認の結果を共有した（リクエストを送らなかった）件数"""
+        return self.results[device].flag_count(FLAG_COALESCED)
+
+    def retry_count(self, device):
+        """結果が確定するまでに行った再試行の合計回数"""
+        return self.results[device].retry_count()
+
+    def success_urls(self, device):
+        return [r.url for r in self.results[device] if r.success]
+
+    def all_results(self):
+        for device in (DEVICE_RT, DEVICE_HUB, DEVICE_AP):
+            yield from self.results[device]
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "site": self.site.get("name") or self.site["ip"],
+            "host": self.site["ip"],
+            "address": self.address,
+            "mode": self.mode,
+            "started_at": self.started_at.strftime("%Y/%m/%d %H:%M:%S"),
+            "elapsed_sec": round(self.elapsed, 3),
+            "stopped": self.stopped,
+            "stop_latency_ms": round(self.stop_latency * 1000, 1) if self.stop_latency is not None else None,
+            "concurrency": dict(zip(("start", "end"), self.concurrency)) if self.concurrency else None,
+            "summary": {
+                device: dict(zip(("success", "fail"), self.counts(device)), retries=self.retry_count(device),
+                             coalesced=self.coalesced_count(device))
+                for device in (DEVICE_RT, DEVICE_HUB, DEVICE_AP)
+            },
+            "stages": [st.to_dict() for st in self.stages],
+            "results": [r.to_dict() for r in self.all_results()],
+        }
+
+
+def make_site(ip, hub_count=1, hub_start=1, hub_timeout=DEFAULT_HUB_TIMEOUT_SEC,
+              ap_count=6, ap_start=1, ap_timeout=DEFAULT_TIMEOUT_SEC, name=None, line=None):
+    """GUI の入力フォームと同じキーを持つ拠点設定の辞書を作る"""
+    return {
+        "name": name,
+        "line": line,
+        "ip": ip,
+        "hub_count": hub_count,
+        "hub_start": hub_start,
+        "hub_timeout": hub_timeout,
+        "ap_count": ap_count,
+        "ap_start": ap_start,
+        "ap_timeout": ap_timeout,
+    }
+
+
+class TargetRange:
+    """連続したポート範囲の確認対象 (host, port, url)
+
+    リストを作らずに範囲だけを持ち、取り出すたびに先頭から (host, port, url) を作る。
+    何度でも取り出せ、len() で件数を返す。
+    """
+
+    __slots__ = ("host", "ports")
+
+    def __init__(self, host, ports):
+        self.host = host
+        self.ports = ports  # range
+
+    def __iter__(self):
+        host = self.host
+        for port in self.ports:
+            yield host, port, f"http://{host}:{port}"
+
+    def __len__(self):
+        return len(self.ports)
+
+
+def build_targets(ip, base_port, count, start_num, device_name, on_log=None):
+    """疎通確認対象の TargetRange を作る。範囲外のポートは警告して除外する"""
+    first = base_port + start_num
+    ports = range(first, first + max(0, count))
+    valid = range(max(first, 1), max(min(ports.stop, 65536), first, 1))
+    if on_log and len(valid) < len(ports):
+        on_log(f"{device_name}ポート不正: {ports.start}〜{ports.stop - 1}（{len(ports) - len(valid)}件を除外）", "warn")
+    return TargetRange(ip, valid)
+
+
+def take_jobs(jobs, count):
+    """jobs（イテレーター）から最大 count 件を取り出し、(ジョブのリスト, jobs を使い切ったか) を返す
+
+    jobs は、まだ用意できていないジョブの代わりに None を返してよい（事前スキャンの結果待ちなど）。
+    None が来た時点で取り出しをやめ、次の呼び出しで続きを取り出す。
+    """
+    taken = []
+    for _ in range(count):
+        job = next(jobs, _NO_MORE_JOBS)
+        if job is _NO_MORE_JOBS:
+            return taken, True
+        if job is None:
+            break
+        taken.append(job)
+    return taken, False
+
+
+def iter_sweeps(sites, run_one, parallel=4):
+    """sites（イテラブル）を最大 parallel 拠点ずつ run_one(site) で実行し、終わった順に結果を返すジェネレーター
+
+    次の拠点は実行中の拠点が終わってから取り出すため、拠点が何百あっても
+    保持するのは実行中の parallel 拠点分だけで済む。
+    """
+    sites = iter(sites)
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        pending = {executor.submit(run_one, site) for site in islice(sites, parallel)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                site = next(sites, None)
+                if site is not None:
+                    pending.add(executor.submit(run_one, site))
+
+
+class Phase:
+    """1フェーズ（機器種別1つ）分の確認対象・タイムアウト・結果"""
+
+    def __init__(self, device, host, targets, timeout_sec):
+        self.device = device
+        self.host = host
+        self.timeout_sec = timeout_sec
+        self.restrict(targets)
+
+    def restrict(self, targets):
+        """確認対象を targets にする（継続監視で一部のポートだけを確認する場合など）"""
+        self.targets = targets
+        ports = targets.ports if isinstance(targets, TargetRange) else [port for _, port, _ in targets]
+        self.results = PortTable(self.device, self.host, ports, ProbeResult)
+
+    def resolve(self, result):
+        """確認前に結果を確定させる（キャッシュ流用など）"""
+        self.results.put(result)
+
+    def probe_targets(self):
+        """実際に確認が必要な（結果の確定していない） targets を順に返す"""
+        results = self.results
+        return (t for t in self.targets if results.is_pending(t[1]))
+
+
+class _PortTask:
+    """1ポート分の HTTP 確認の進行状況（再試行・ヘッジを含む）"""
+
+    __slots__ = ("phase", "host", "port", "url", "attempts", "outstanding", "first_started", "started",
+                 "hedged_attempt", "done")
+
+    def __init__(self, phase, host, port, url):
+        self.phase = phase
+        self.host = host
+        self.port = port
+        self.url = url
+        self.attempts = 0
+        self.outstanding = 0  # 実行中・待機中のリクエスト数（ヘッジ中は 2）
+        self.first_started = None
+        self.started = None  # 最新の試行を開始した時刻
+        self.hedged_attempt = 0  # ヘッジを出した試行の番号
+        self.done = False
+
+
+class ProbeEngine:
+    """スケジューラーのワーカースレッドで HTTP 疎通確認を行うエンジン
+
+    on_log(message, level) は実行スレッドやワーカースレッドから呼ばれる。
+    進捗は progress（probe_progress.ProgressModel、省略時は新規作成）に書き込むだけなので、
+    表示側は好きな間隔でそれを読めばよい。
+    stop_event がセットされると、完了済みの結果までで処理を打ち切る。
+    prescan が有効な場合は、TCP 接続できたポートだけを HTTP 確認に回す。
+    connect_timeout を省略すると TCP 事前スキャンにも各フェーズのタイムアウトを使う。
+    scheduler を共有すると複数回線を1つの同時実行枠で並行実行でき、
+    このエンジン（1実行）の同時実行数は max_workers に制限される。
+    adaptive が有効な場合は、計測した応答時間からホストごとのタイムアウトを決め、
+    これから開始する確認に適用する（入力されたタイムアウトは上限として扱う）。
+    history（probe_history.HistoryStore）を渡すと、全ての結果を履歴に保存する。
+    metrics_dir を渡すと、実行ごとの応答時間ヒストグラムをそのディレクトリに書き出す。
+    ホスト名は実行の開始時に dns_cache（省略時はプロセス内で共有するキャッシュ）で1回だけ解決する。
+    HTTP 確認に失敗したポートは retry_policies（機器種別 -> RetryPolicy）に従って再試行する。
+    hedge が有効な場合は、応答時間の p95 を過ぎても応答のない確認に2本目のリクエストを出し、
+    先に成功した方を採用する。再試行もヘッジも同じ同時実行枠の中で行う。
+    adaptive_concurrency が有効な場合は、ホストへの同時実行数を max_workers に固定せず、
+    concurrency（probe_concurrency.ConcurrencyController、省略時は共有のもの）が
+    応答時間とタイムアウトの割合から学習した値にする。
+    TCP 事前スキャンも HTTP 確認（再試行・ヘッジを含む）も、接続の前に rate_limiter
+    （probe_ratelimit.RateLimiter、省略時はスケジューラーのもの）からホストのトークンを取る。
+    同じ (host, port) の HTTP 確認が他の回線・他の実行で進行中なら、新しいリクエストは送らず
+    single_flight（probe_singleflight.SingleFlight、省略時は共有のもの）でその結果を共有する
+    （ヘッジは同じポートへの2本目のリクエストなので共有しない）。
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, stop_event=None, on_log=None, progress=None,
+                 probe_method=DEFAULT_PROBE_METHOD, prescan=True, connect_timeout=None, scheduler=None,
+                 adaptive=True, rtt_tracker=None, history=None, metrics_dir=None, dns_cache=None,
+                 retry_policies=None, hedge=False, adaptive_concurrency=True, concurrency=None, rate_limiter=None,
+                 single_flight=None):
+        self.max_workers = max_workers
+        self.retry_policies = DEFAULT_RETRY_POLICIES if retry_policies is None else retry_policies
+        self.hedge = hedge
+        self.dns = dns_cache or get_dns_cache()
+        self.history = history
+        self.metrics_dir = metrics_dir
+        self.adaptive = adaptive
+        self.rtt = rtt_tracker or get_rtt_tracker()
+        self.adaptive_concurrency = adaptive_concurrency
+        self.concurrency = concurrency or get_concurrency_controller()
+        self.scheduler = scheduler or get_scheduler()
+        self.rate_limiter = rate_limiter or self.scheduler.rate_limiter
+        self.flights = single_flight or get_single_flight()
+        self.probe_method = probe_method
+        self.prescan = prescan
+        self.connect_timeout = connect_timeout
+        self.stage_stats = []
+        self.inflight = InflightSockets()
+        self.stop_event = stop_event or threading.Event()
+        self.on_log = on_log
+        self.progress = progress or ProgressModel()
+
+    def _log(self, message, level="info"):
+        if self.on_log:
+            self.on_log(message, level)
+
+    def check_connection(self, url, timeout_sec):
+        """url にリクエストを送り、HTTP 応答があれば成功とする（timeout_sec は秒数か (接続, 応答待ち) の組）"""
+        session = get_session(AIMD_MAX_LIMIT if self.adaptive_concurrency else self.max_workers)
+        try:
+            if self.probe_method == PROBE_HEAD:
+                session.head(url, timeout=timeout_sec, allow_redirects=False)
+            elif self.probe_method == PROBE_STREAM:
+                # 本文は読まずに閉じる（管理画面のHTMLを毎回ダウンロードしない）
+                session.get(url, timeout=timeout_sec, stream=True).close()
+            else:
+                session.get(url, timeout=timeout_sec)
+            return True, url
+        except _http().RequestException:
+            return False, url
+
+    def _effective_timeout(self, host, timeout_sec):
+        """確認を開始する時点で使う (接続, 応答待ち) のタイムアウト
+
+        適応タイムアウトは接続にだけ使い、応答待ちは入力値のままにする
+        （同じ RT の他の機器より応答が遅いだけの機器を失敗にしない）。
+        """
+        connect_timeout = self.rtt.timeout_for(host, timeout_sec) if self.adaptive else timeout_sec
+        return connect_timeout, timeout_sec
+
+    def _retry_policy(self, device):
+        return self.retry_policies.get(device) or RetryPolicy()
+
+    def _hedge_after(self, host, timeout_sec):
+        """ヘッジを出すまでの秒数。無効、または応答時間の実績がなければ None"""
+        if not self.hedge:
+            return None
+        p95 = self.rtt.percentile(host)
+        if p95 is None:
+            return None
+        delay = max(HEDGE_MIN_DELAY_SEC, p95)
+        return delay if delay < timeout_sec else None
+
+    def _next_retry_delay(self, task, now):
+        """再試行するなら待ち秒数を、しないなら None を返す"""
+        if self.stop_event.is_set():
+            return None
+        policy = self._retry_policy(task.phase.device)
+        delay = policy.delay(task.attempts)
+        return delay if policy.allows(task.attempts, now + delay - task.first_started) else None
+
+    def _concurrency_limit(self, host):
+        """host への同時実行数。自動調整が無効なら max_workers"""
+        return self.concurrency.limit_for(host) if self.adaptive_concurrency else self.max_workers
+
+    def _observe(self, host, result):
+        """確認1件の結果を応答時間の記録と同時実行数の調整に使う"""
+        if result.success:
+            self.rtt.record(host, result.elapsed)
+        if not self.adaptive_concurrency:
+            return
+        if result.success:
+            self.concurrency.observe(host, result.port, result.elapsed, False)
+        # 接続できた（または TCP 事前スキャンを通った）のに応答がないものだけを混雑とみなし、
+        # 機器のないポートのタイムアウトでは同時実行数を下げない（応答したことのないポートは
+        # ConcurrencyController 側でも数えない）
+        elif (result.timeout is not None and result.elapsed >= result.timeout * AIMD_TIMEOUT_MARGIN
+              and (self.prescan or result.connect is not None)):
+            self.concurrency.observe(host, result.port, result.elapsed, True)
+
+    @staticmethod
+    def _coalesced(shared, device):
+        """他の確認の結果を、この確認の結果として使うための複製を作る"""
+        result = copy.copy(shared)
+        result.device = device
+        result.coalesced = True
+        return result
+
+    def _flight_key(self, device, host, port):
+        """同時の確認をまとめるキー
+
+        適応タイムアウト・プローブ方式・再試行ポリシーが同じ確認だけをまとめる。
+        設定の違う実行（他の回線タブなど）の確認は、結果の意味が変わるため共有せず別に確認する。
+        タイムアウトの違いは SingleFlight.begin() で扱う（短い方に合流し、失敗なら確認し直す）。
+        """
+        policy = self._retry_policy(device)
+        return host, port, self.adaptive, self.probe_method, policy.attempts, policy.deadline_sec
+
+    @staticmethod
+    def _reuse_shared(shared, shared_timeout, timeout_sec):
+        """合流した確認の結果をそのまま使えるか（短いタイムアウトでの失敗は確認し直す）"""
+        return shared.success or shared_timeout is None or shared_timeout >= timeout_sec
+
+    def _wait_shared(self, future):
+        """実行中の確認の結果を待つ（停止要求があれば None を返す）"""
+        while True:
+            try:
+                return future.result(timeout=STOP_POLL_SEC)
+            except FuturesTimeoutError:
+                if self.stop_event.is_set():
+                    return None
+
+    def _probe(self, device, host, port, url, timeout_sec, coalesce=True):
+        if not coalesce:
+            return self._probe_once(device, host, port, url, timeout_sec)
+        key = self._flight_key(device, host, port)
+        while True:
+            future, leader, shared_timeout = self.flights.begin(key, timeout_sec)
+            if future is None:
+                return self._probe_once(device, host, port, url, timeout_sec)
+            if leader:
+                break
+            shared = self._wait_shared(future)
+            if self.stop_event.is_set():
+                return ProbeResult(device, url, port, False)
+            if shared is None:
+                continue
+            if self._reuse_shared(shared, shared_timeout, timeout_sec):
+                return self._coalesced(shared, device)
+            return self._probe_once(device, host, port, url, timeout_sec)
+        result = None
+        try:
+            result = self._probe_once(device, host, port, url, timeout_sec)
+            return result
+        finally:
+            # 停止で中断した結果は共有しない（待っていた側が自分で確認し直す）
+            self.flights.finish(key, future, None if self.stop_event.is_set() else result)
+
+    def _probe_once(self, device, host, port, url, timeout_sec):
+        connect_timeout, read_timeout = self._effective_timeout(host, timeout_sec)
+        timing = {}
+        started = time.perf_counter()
+        inflight = _http().inflight
+        inflight.registry = self.inflight
+        inflight.timing = timing
+        inflight.dns = self.dns
+        try:
+            is_success, _ = self.check_connection(url, (connect_timeout, read_timeout))
+        finally:
+            inflight.registry = None
+            inflight.timing = None
+            inflight.dns = None
+        result = ProbeResult(device, url, port, is_success, elapsed=time.perf_counter() - started,
+                             timeout=connect_timeout, timing=timing)
+        self._observe(host, result)
+        return result
+
+    def _probe_task(self, task, hedge=False):
+        task.started = time.perf_counter()
+        return self._probe(task.phase.device, task.host, task.port, task.url, task.phase.timeout_sec,
+                           coalesce=not hedge)
+
+    def _check_targets(self, jobs, on_result):
+        """HTTP 確認のジョブ (phase, host, port, url) を並列に実行し、確定順に on_result(phase, result) を呼ぶ
+
+        jobs はイテラブルでよく、結果の確定していないポートが同時実行数の上限 × PIPELINE_WINDOW_FACTOR 件に
+        なるまでしか取り出さない（残りは空きが出てから取り出す）。まだ用意できていないジョブの代わりに
+        None を返してもよく、その間も実行中の確認は進め、STOP_POLL_SEC ごとに取り出し直す。
+        同時実行数は投入のたびにホストの現在の値を使うため、実行中の調整もすぐに反映される。
+        on_result はこのメソッドを呼んだスレッドからのみ呼ばれる。
+        失敗したポートの再試行はバックオフの間ワーカーを占有しないよう、待ち行列（retry_queue）に
+        積んでおき、時刻が来たらスケジューラーに投入し直す。ヘッジも同じスケジューラーに投入する。
+        停止要求は STOP_POLL_SEC ごとに確認し、未着手のジョブの取り消しと
+        応答待ちソケットの切断を行ってすぐに戻る。
+        """
+        future_to_task = {}
+        retry_queue = []  # (投入時刻, 連番, _PortTask)
+        sequence = 0
+
+        def submit(task, hedge=False):
+            if not hedge:
+                task.attempts += 1
+            task.outstanding += 1
+            limit = self._concurrency_limit(task.host)
+            future = self.scheduler.submit(self, task.host, self._probe_task, task, hedge,
+                                           run_limit=limit, host_limit=limit)
+            future_to_task[future] = task
+
+        def finish(task, result):
+            task.done = True
+            active[0] -= 1
+            result.attempts = task.attempts
+            result.hedged = task.hedged_attempt > 0
+            on_result(task.phase, result)
+
+        jobs = iter(jobs)
+        window = (AIMD_MAX_LIMIT if self.adaptive_concurrency else self.max_workers) * PIPELINE_WINDOW_FACTOR
+        active = [0]  # 結果の確定していないポート数（再試行の待機中を含む）
+        exhausted = [False]  # jobs を使い切ったか
+
+        def refill():
+            taken, exhausted[0] = take_jobs(jobs, max(0, window - active[0]))
+            for phase, host, port, url in taken:
+                task = _PortTask(phase, host, port, url)
+                task.first_started = time.perf_counter()
+                active[0] += 1
+                submit(task)
+
+        refill()
+        pending = set(future_to_task)
+        try:
+            while (pending or retry_queue or not exhausted[0]) and not self.stop_event.is_set():
+                if pending:
+                    done, pending = wait(pending, timeout=STOP_POLL_SEC, return_when=FIRST_COMPLETED)
+                else:
+                    done = ()
+                    wait_sec = retry_queue[0][0] - time.perf_counter() if retry_queue else STOP_POLL_SEC
+                    self.stop_event.wait(min(STOP_POLL_SEC, max(0.0, wait_sec)))
+                for future in done:
+                    if self.stop_event.is_set():
+                        break
+
+                    task = future_to_task.pop(future)
+                    task.outstanding -= 1
+                    try:
+                        result = future.result()
+                    except Exception as exc:
+                        result = ProbeResult(task.phase.device, task.url, task.port, False, error=exc)
+                    if task.done:
+                        continue  # ヘッジのもう一方が先に確定している
+                    if result.success:
+                        finish(task, result)
+                    elif task.outstanding == 0:
+                        now = time.perf_counter()
+                        delay = self._next_retry_delay(task, now)
+                        if delay is None:
+                            finish(task, result)
+                        else:
+                            sequence += 1
+                            heapq.heappush(retry_queue, (now + delay, sequence, task))
+
+                # --- 確定した分だけ新しいジョブを取り出し、時刻が来た再試行を投入する ---
+                refill()
+                now = time.perf_counter()
+                while retry_queue and retry_queue[0][0] <= now and not self.stop_event.is_set():
+                    submit(heapq.heappop(retry_queue)[2])
+                # --- p95 を過ぎても応答のない確認にヘッジを出す ---
+                if self.hedge:
+                    for task in list(future_to_task.values()):
+                        if task.done or task.started is None or task.outstanding != 1:
+                            continue
+                        if task.hedged_attempt == task.attempts:
+                            continue
+                        hedge_after = self._hedge_after(task.host, task.phase.timeout_sec)
+                        if hedge_after is not None and now - task.started >= hedge_after:
+                            task.hedged_attempt = task.attempts
+                            submit(task, hedge=True)
+                # ヘッジのもう一方が確定したリクエストは待たない（ワーカーはタイムアウトまで使われる）
+                pending = {future for future, task in future_to_task.items() if not task.done}
+        finally:
+            # 停止時は未着手のジョブを取り消し、応答待ちの接続を切る
+            self.scheduler.cancel_run(self)
+            if self.stop_event.is_set():
+                self.inflight.abort_all()
+
+    def _tcp_stage(self, phases, reject):
+        """全フェーズの TCP 事前スキャンを別スレッドで1回にまとめて行い、HTTP 確認に回すジョブを返すジェネレーター
+
+        接続できたポートのジョブはスキャン全体の完了を待たずに確定した順に返し、
+        次の結果がまだ届いていない間は None を返す（_check_targets はその間も HTTP 確認を進める）。
+        接続できなかったポートは reject(phase, result) で失敗として確定させる。
+        """
+        stats = {id(p): StageStats(p.device, STAGE_TCP, self.connect_timeout or p.timeout_sec) for p in phases}
+        remaining = {id(p): len(p.targets) - len(p.results) for p in phases}  # スキャンの終わっていないポート数
+        probes = (
+            (host, port, stats[id(phase)].timeout_sec, (phase, host, port, url))
+            for phase in phases for host, port, url in phase.probe_targets()
+        )
+        events = queue.SimpleQueue()  # スキャンのスレッド -> このジェネレーター（None は終了の合図）
+        started = time.perf_counter()
+
+        def scan():
+            try:
+                for event in iter_tcp_prescan(
+                    probes, self.stop_event, resolve=lambda host: self.dns.lookup(host) or host,
+                    rtt_factor=RTT_SAFETY_FACTOR if self.adaptive else None, min_timeout_sec=ADAPTIVE_MIN_TIMEOUT_SEC,
+                    rate_limiter=self.rate_limiter,
+                ):
+                    events.put(event)
+            finally:
+                events.put(None)
+
+        def finish_stage(phase):
+            phase_stats = stats[id(phase)]
+            phase_stats.elapsed = time.perf_counter() - started
+            self.stage_stats.append(phase_stats)
+            self._log(phase_stats.describe())
+
+        def scanned(phase):
+            # フェーズの全ポートのスキャンが終わったら、HTTP 確認の集計より先に記録する
+            remaining[id(phase)] -= 1
+            if remaining[id(phase)] == 0:
+                finish_stage(phase)
+
+        for phase in phases:
+            if remaining[id(phase)] == 0:
+                finish_stage(phase)
+        threading.Thread(target=scan, daemon=True).start()
+        while True:
+            try:
+                event = events.get_nowait()
+            except queue.Empty:
+                yield None
+                continue
+            if event is None:
+                break
+            (phase, host, port, url), connect_sec = event
+            phase_stats = stats[id(phase)]
+            phase_stats.total += 1
+            if connect_sec is not None:
+                phase_stats.passed += 1
+                scanned(phase)
+                yield phase, host, port, url
+            else:
+                scanned(phase)
+                reject(phase, ProbeResult(phase.device, url, port, False,
+                                          elapsed=time.perf_counter() - started, stage=STAGE_TCP))
+
+    def _run_phases(self, phases, on_phase=None, on_results=None, on_result=None):
+        """複数フェーズの確認を1つのバッチとしてまとめて実行する
+
+        各フェーズは自分のタイムアウトで確認され、全ポートの結果が揃った時点で
+        ポート順にソートして on_results(device, results) に渡される。
+        on_result(device, result) を渡すと、フェーズの完了を待たずに1件ずつポート順に受け取れる
+        （手前のポートが全て確定した時点で渡すため、速く応答したポートは遅いポートを待たずに届く）。
+        所要時間は各フェーズの合計ではなく、おおよそ最も遅いフェーズの時間になる。
+        """
+        total = sum(len(p.targets) for p in phases)
+        if total == 0:
+            return
+        # 総数は RT+HUB+AP の全ポート。キャッシュから流用した結果は最初から完了として数える
+        self.progress.start(total, done=sum(len(p.results) for p in phases))
+        for phase in phases:
+            if on_phase:
+                on_phase(phase.device, "start")
+
+        http_stats = {id(p): StageStats(p.device, STAGE_HTTP, p.timeout_sec) for p in phases}
+        http_started = time.perf_counter()
+
+        def emit(phase):
+            if on_result:
+                for ready in phase.results.take_ready():
+                    on_result(phase.device, ready)
+
+        # キャッシュから流用した結果は先に出す
+        for phase in phases:
+            emit(phase)
+
+        def complete(phase):
+            stats = http_stats[id(phase)]
+            stats.elapsed = time.perf_counter() - http_started
+            self.stage_stats.append(stats)
+            if self.prescan:
+                self._log(stats.describe())
+            if on_results:
+                on_results(phase.device, phase.results)
+            if on_phase:
+                on_phase(phase.device, "done")
+
+        def record(phase, result):
+            phase.results.put(result)
+            if result.success:
+                http_stats[id(phase)].passed += 1
+            self.progress.advance()
+            emit(phase)
+            if len(phase.results) == len(phase.targets):
+                complete(phase)
+
+        def counted(jobs):
+            for job in jobs:
+                if job is not None:
+                    http_stats[id(job[0])].total += 1
+                yield job
+
+        for phase in phases:
+            if len(phase.results) == len(phase.targets):
+                complete(phase)
+        # ジョブは _check_targets が取り出す時に作る（事前スキャンありなら接続できたポートから順に届く）
+        if self.prescan:
+            jobs = self._tcp_stage(phases, record)
+        else:
+            jobs = ((phase, host, port, url) for phase in phases for host, port, url in phase.probe_targets())
+        if not self.stop_event.is_set():
+            self._check_targets(counted(jobs), record)
+
+    def build_phases(self, site, mode=MODE_BATCH):
+        """実行モードに応じて RT/HUB/AP のフェーズを作る"""
+        ip = site["ip"]
+        phases = []
+        if mode in (MODE_BATCH, MODE_HUB, MODE_RT):
+            # 一括実行では AP のタイムアウト、HUB実行では HUB のタイムアウトを使う
+            rt_timeout = site["hub_timeout"] if mode == MODE_HUB else site["ap_timeout"]
+            phases.append(Phase(DEVICE_RT, ip, [(ip, RT_HUB_BASE_PORT, f"http://{ip}:{RT_HUB_BASE_PORT}")], rt_timeout))
+        if mode in (MODE_BATCH, MODE_HUB):
+            phases.append(Phase(DEVICE_HUB, ip, build_targets(
+                ip, RT_HUB_BASE_PORT, site["hub_count"], site["hub_start"], DEVICE_HUB, self.on_log
+            ), site["hub_timeout"]))
+        if mode in (MODE_BATCH, MODE_AP):
+            phases.append(Phase(DEVICE_AP, ip, build_targets(
+                ip, AP_BASE_PORT, site["ap_count"], site["ap_start"], DEVICE_AP, self.on_log
+            ), site["ap_timeout"]))
+        return phases
+
+    def _resolve_site(self, sweep):
+        """拠点のホスト名を1回だけ解決し、解決結果をログに残す（IPアドレスの入力なら何もしない）"""
+        host = sweep.site["ip"]
+        if is_ip_literal(host):
+            sweep.address = host
+            return
+        try:
+            resolution = self.dns.resolve(host)
+        except (OSError, UnicodeError) as e:
+            self._log(f"名前解決に失敗しました: {host} ({e})", "warn")
+            return
+        sweep.address = resolution.address
+        source = "キャッシュ" if resolution.cached else f"{resolution.elapsed * 1000:.0f}ミリ秒"
+        self._log(f"名前解決: {host} → {resolution.address}（{source}）")
+
+    def run_site(self, site, mode=MODE_BATCH, on_phase=None, on_results=None, cache=None, recheck_failures=False,
+                 ports=None, on_result=None):
+        """1拠点分の RT/HUB/AP 疎通確認を1つのバッチとして実行する
+
+        on_phase(device, "start"|"done") は各フェーズの開始・終了時に、
+        on_results(device, results) は各フェーズの結果確定時（フェーズの完了順）に呼ばれる。
+        cache（probe_cache.ResultCache）を渡すと結果を記録し、recheck_failures が真なら
+        期限内の成功結果をキャッシュから流用して、それ以外のポートだけを確認する。
+        ports（ポート番号の集合）を渡すと、そのポートだけを確認する（継続監視用）。
+        on_result(device, result) には、フェーズの完了を待たずに1件ずつポート順に渡される。
+        """
+        sweep = SweepResult(site, mode)
+        started = time.perf_counter()
+        self.stage_stats = sweep.stages
+        self._resolve_site(sweep)
+        learned = self.concurrency.is_learned(site["ip"])
+        concurrency_start = self._concurrency_limit(site["ip"])
+        if self.adaptive_concurrency:
+            self._log(f"同時実行数: {concurrency_start}（{'学習値' if learned else '初期値'}）")
+
+        if self.history is not None:
+            self.history.record_run(sweep.run_id, site["ip"], mode, line=site.get("line"))
+
+        def finish(device, results):
+            if self.history is not None:
+                self.history.record_results(sweep.run_id, site["ip"], results, line=site.get("line"))
+            if on_results:
+                on_results(device, results)
+
+        phases = self.build_phases(site, mode)
+        if ports is not None:
+            for phase in phases:
+                phase.restrict([t for t in phase.targets if t[1] in ports])
+        if cache is not None:
+            # 回線タブのキャッシュは長時間残るため、実行のたびに期限切れの結果を捨てておく
+            cache.purge()
+        if cache is not None and recheck_failures:
+            for phase in phases:
+                for host, port, _ in phase.targets:
+                    cached = cache.get(host, port)
+                    if cached is not None and cached.success:
+                        reused = copy.copy(cached)
+                        reused.device = phase.device
+                        reused.from_cache = True
+                        reused.coalesced = False
+                        phase.resolve(reused)
+        self._run_phases(phases, on_phase, finish, on_result)
+        for phase in phases:
+            sweep.results[phase.device] = phase.results
+            if cache is not None:
+                for result in phase.results:
+                    if not result.from_cache:
+                        cache.put(site["ip"], result)
+
+        sweep.stopped = self.stop_event.is_set()
+        if self.adaptive_concurrency and not sweep.stopped:
+            # ポート数が1巡に満たない拠点でも学習できるよう、残りの確認で見直してから保存する
+            self.concurrency.close_round(site["ip"])
+        sweep.elapsed = time.perf_counter() - started
+        sweep.concurrency = (concurrency_start, self._concurrency_limit(site["ip"]))
+        if self.adaptive and not sweep.stopped:
+            samples = self.rtt.samples(site["ip"])
+            if samples:
+                p95 = self.rtt.percentile(site["ip"])
+                limit = max(phase.timeout_sec for phase in phases)
+                self._log(f"適応タイムアウト: RTT p95 {p95 * 1000:.0f}ミリ秒（{len(samples)}件）"
+                          f"→ 以降の接続待ちは最大{self.rtt.timeout_for(site['ip'], limit):.2f}秒")
+        if sweep.stopped:
+            # CancelToken なら停止要求の時刻から、このメソッドが戻るまでの時間を記録する
+            cancelled_at = getattr(self.stop_event, "cancelled_at", None)
+            if cancelled_at is not None:
+                sweep.stop_latency = time.perf_counter() - cancelled_at
+                self._log(f"緊急停止: 要求から{sweep.stop_latency * 1000:.0f}ミリ秒で中断しました", "warn")
+        else:
+            if self.adaptive_concurrency:
+                try:
+                    self.concurrency.save()
+                except OSError as e:
+                    self._log(f"同時実行数の学習値を保存できません: {e}", "warn")
+            if self.metrics_dir:
+                try:
+                    write_run_metrics(sweep, self.metrics_dir)
+                except OSError as e:
+                    self._log(f"メトリクスを書き出せません: {e}", "warn")
+        return sweep
+
+
+class AsyncProbeEngine(ProbeEngine):
+    """asyncio のストリームで HTTP 疎通確認を行うエンジン
+
+    1スレッドのイベントループ上で最大 max_in_flight 件のプローブを同時に待ち受ける。
+    ステータス行（HTTP/...）が返ってくれば成功とする点は ProbeEngine と同じ。
+    本文は読まないため、probe_method は HEAD か GET かの選択にのみ使う。
+    """
+
+    def __init__(self, max_in_flight=MAX_ASYNC_IN_FLIGHT, **kwargs):
+        super().__init__(**kwargs)
+        self.max_in_flight = max_in_flight
+
+    async def _async_open(self, host, port, timing):
+        """名前解決と TCP 接続の時間を timing に記録しながら接続する"""
+        started = time.perf_counter()
+        address = self.dns.lookup(host)
+        if address is None:
+            # キャッシュにない場合だけ、イベントループを止めないよう別スレッドで解決する
+            resolution = await asyncio.get_running_loop().run_in_executor(None, self.dns.resolve, host)
+            address = resolution.address
+        timing["dns"] = time.perf_counter() - started
+        started = time.perf_counter()
+        connection = await asyncio.open_connection(address, port)
+        timing["connect"] = time.perf_counter() - started
+        return connection
+
+    async def _async_probe(self, device, host, port, url, timeout_sec, coalesce=True):
+        if not coalesce:
+            return await self._async_probe_once(device, host, port, url, timeout_sec)
+        key = self._flight_key(device, host, port)
+        while True:
+            future, leader, shared_timeout = self.flights.begin(key, timeout_sec)
+            if future is None:
+                return await self._async_probe_once(device, host, port, url, timeout_sec)
+            if leader:
+                break
+            # 他のスレッド（他の回線のイベントループ）で実行中の確認の結果を待つ
+            shared = await self._async_wait_shared(future)
+            if self.stop_event.is_set():
+                return ProbeResult(device, url, port, False)
+            if shared is None:
+                continue
+            if self._reuse_shared(shared, shared_timeout, timeout_sec):
+                return self._coalesced(shared, device)
+            return await self._async_probe_once(device, host, port, url, timeout_sec)
+        result = None
+        try:
+            result = await self._async_probe_once(device, host, port, url, timeout_sec)
+            return result
+        finally:
+            self.flights.finish(key, future, None if self.stop_event.is_set() else result)
+
+    async def _async_wait_shared(self, future):
+        """実行中の確認の結果を待つ（停止要求があれば None を返す）"""
+        waiter = asyncio.wrap_future(future)
+        while not waiter.done():
+            await asyncio.wait([waiter], timeout=STOP_POLL_SEC)
+            if self.stop_event.is_set() and not waiter.done():
+                waiter.cancel()
+                return None
+        return waiter.result()
+
+    async def _async_probe_once(self, device, host, port, url, timeout_sec):
+        connect_timeout, read_timeout = self._effective_timeout(host, timeout_sec)
+        timing = {}
+        started = time.perf_counter()
+        writer = None
+        try:
+            # requests と同様、接続（名前解決を含む）と応答待ちにそれぞれのタイムアウトを適用する
+            reader, writer = await asyncio.wait_for(self._async_open(host, port, timing), connect_timeout)
+            method = "HEAD" if self.probe_method == PROBE_HEAD else "GET"
+            writer.write(f"{method} / HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode("ascii"))
+            await writer.drain()
+            sent = time.perf_counter()
+            status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+            timing["ttfb"] = time.perf_counter() - sent
+            is_success = status_line.startswith(b"HTTP/")
+        except (OSError, asyncio.TimeoutError, UnicodeError):
+            is_success = False
+        finally:
+            if writer is not None:
+                writer.close()
+        result = ProbeResult(device, url, port, is_success, elapsed=time.perf_counter() - started,
+                             timeout=connect_timeout, timing=timing)
+        self._observe(host, result)
+        return result
+
+    async def _async_check_targets(self, jobs, on_result):
+        # 全体で max_in_flight 件まで。同時実行数の自動調整が有効ならホストごとの上限も守る
+        in_flight = {}
+        slot_freed = asyncio.Condition()
+
+        def has_slot(host):
+            if sum(in_flight.values()) >= self.max_in_flight:
+                return False
+            return not self.adaptive_concurrency or in_flight.get(host, 0) < self._concurrency_limit(host)
+
+        async def limited(phase, host, port, url, coalesce=True):
+            # トークンが取れるまで待ってから同時実行枠を取る（トークン待ちの間は枠を占有しない）
+            while True:
+                token_wait = self.rate_limiter.try_acquire(host)
+                if not token_wait:
+                    break
+                await asyncio.sleep(token_wait)
+            async with slot_freed:
+                await slot_freed.wait_for(lambda: has_slot(host))
+                in_flight[host] = in_flight.get(host, 0) + 1
+            try:
+                return await self._async_probe(phase.device, host, port, url, phase.timeout_sec, coalesce)
+            finally:
+                async with slot_freed:
+                    in_flight[host] -= 1
+                    slot_freed.notify_all()
+
+        async def hedged(phase, host, port, url):
+            """1回分の試行。p95 を過ぎても応答がなければ2本目を出し、先に成功した方を返す"""
+            tasks = [asyncio.ensure_future(limited(phase, host, port, url))]
+            try:
+                if not self.hedge:
+                    return await tasks[0], False
+                # 応答時間の実績は確認が進むにつれて集まるため、p95 は待っている間も見直す
+                started = time.perf_counter()
+                while not tasks[0].done():
+                    hedge_after = self._hedge_after(host, phase.timeout_sec)
+                    if hedge_after is not None and time.perf_counter() - started >= hedge_after:
+                        break
+                    await asyncio.wait(tasks, timeout=STOP_POLL_SEC)
+                if tasks[0].done():
+                    return tasks[0].result(), False
+                tasks.append(asyncio.ensure_future(limited(phase, host, port, url, coalesce=False)))
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        result = task.result()
+                        if result.success:
+                            return result, True
+                return result, True
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        async def with_retry(phase, host, port, url):
+            # バックオフ中は semaphore を持たないので、他のポートの確認を止めない
+            policy = self._retry_policy(phase.device)
+            first_started = time.perf_counter()
+            attempts = 0
+            was_hedged = False
+            while True:
+                attempts += 1
+                result, used_hedge = await hedged(phase, host, port, url)
+                was_hedged = was_hedged or used_hedge
+                if result.success or self.stop_event.is_set():
+                    break
+                delay = policy.delay(attempts)
+                if not policy.allows(attempts, time.perf_counter() + delay - first_started):
+                    break
+                await asyncio.sleep(delay)
+            result.attempts = attempts
+            result.hedged = was_hedged
+            return phase, result
+
+        # タスクは結果の確定していないポートが max_in_flight × PIPELINE_WINDOW_FACTOR 件になるまでしか作らない
+        # （まだ用意できていないジョブは None で届くので、STOP_POLL_SEC ごとに取り出し直す）
+        jobs = iter(jobs)
+        window = self.max_in_flight * PIPELINE_WINDOW_FACTOR
+        taken, exhausted = take_jobs(jobs, window)
+        pending = {asyncio.ensure_future(with_retry(*job)) for job in taken}
+        try:
+            # 停止要求は STOP_POLL_SEC ごとに確認し、残りのタスクを取り消す（接続は finally で閉じる）
+            while (pending or not exhausted) and not self.stop_event.is_set():
+                if pending:
+                    done, pending = await asyncio.wait(pending, timeout=STOP_POLL_SEC,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    done = ()
+                    await asyncio.sleep(STOP_POLL_SEC)
+                for task in done:
+                    if self.stop_event.is_set():
+                        break
+                    on_result(*task.result())
+                if not exhausted:
+                    taken, exhausted = take_jobs(jobs, window - len(pending))
+                    pending.update(asyncio.ensure_future(with_retry(*job)) for job in taken)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _check_targets(self, jobs, on_result):
+        asyncio.run(self._async_check_targets(jobs, on_result))
+
+
+def create_engine(kind=ENGINE_THREAD, **kwargs):
+    """エンジン種別に応じたエンジンを作る"""
+    if kind == ENGINE_ASYNC:
+        return AsyncProbeEngine(**kwargs)
+    return ProbeEngine(**kwargs)
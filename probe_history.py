@@ -0,0 +1,217 @@
+"""疎通確認結果の履歴（SQLite）
+
+全ての確認結果（回線番号・ホスト・機器種別・ポート・結果・応答時間・日時・実行ID）を
+ローカルの SQLite に保存する。書き込みはバックグラウンドのスレッドがまとめて行うため、
+確認処理の速度には影響しない。
+
+照会の例:
+    python probe_history.py last 192.168.1.100 60004
+    python probe_history.py days --limit 30
+"""
+import argparse
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+HISTORY_DB_PATH = "probe_history.db"
+HISTORY_FLUSH_SEC = 0.5  # まとめて書き込む間隔
+HISTORY_BATCH_MAX = 1000  # 1回のトランザクションで書き込む最大件数
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id     TEXT PRIMARY KEY,
+    line       INTEGER,
+    host       TEXT NOT NULL,
+    mode       TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    day        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS probes (
+    id         INTEGER PRIMARY KEY,
+    run_id     TEXT NOT NULL,
+    line       INTEGER,
+    host       TEXT NOT NULL,
+    device     TEXT NOT NULL,
+    port       INTEGER NOT NULL,
+    success    INTEGER NOT NULL,
+    latency_ms REAL,
+    stage      TEXT,
+    checked_at REAL NOT NULL
+);
+-- ホスト・ポートごとの最新結果
+CREATE INDEX IF NOT EXISTS idx_probes_host_port_time ON probes (host, port, checked_at);
+-- ホスト・ポートごとの最終応答（成功のみの部分インデックス）
+CREATE INDEX IF NOT EXISTS idx_probes_last_success ON probes (host, port, checked_at) WHERE success = 1;
+-- 日ごとの実行回数
+CREATE INDEX IF NOT EXISTS idx_runs_day ON runs (day);
+CREATE INDEX IF NOT EXISTS idx_probes_run ON probes (run_id);
+"""
+
+_STOP = object()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class HistoryStore:
+    """確認結果を SQLite に保存する。record_* はどのスレッドからでも呼べる"""
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with _connect(path) as conn:
+            conn.executescript(_SCHEMA)
+        conn.close()
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name="probe-history")
+        self._writer.start()
+
+    # --- 書き込み（キューに積むだけ） ---
+    def record_run(self, run_id, host, mode, line=None, started_at=None):
+        started_at = started_at or time.time()
+        day = datetime.fromtimestamp(started_at).strftime("%Y-%m-%d")
+        self._queue.put(("run", (run_id, line, host, mode, started_at, day)))
+
+    def record_results(self, run_id, host, results, line=None):
+        """1フェーズ分の結果を記録する（確認日時は記録した時刻。結果ごとの確認日時は保持していない）"""
+        checked_at = time.time()
+        rows = [
+            (run_id, line, host, r.device, r.port, int(r.success),
+             round(r.elapsed * 1000, 1), r.stage, checked_at)
+            for r in results if not r.from_cache
+        ]
+        if rows:
+            self._queue.put(("probes", rows))
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        try:
+            while True:
+                try:
+                    items = [self._queue.get(timeout=HISTORY_FLUSH_SEC)]
+                except queue.Empty:
+                    continue
+                while len(items) < HISTORY_BATCH_MAX:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = any(item is _STOP for item in items)
+                self._flush(conn, [item for item in items if item is not _STOP])
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _flush(conn, items):
+        runs = [row for kind, row in items if kind == "run"]
+        probes = [row for kind, rows in items if kind == "probes" for row in rows]
+        if not runs and not probes:
+            return
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)", runs)
+                conn.executemany(
+                    "INSERT INTO probes (run_id, line, host, device, port, success, latency_ms, stage, checked_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", probes
+                )
+        except sqlite3.Error as e:
+            print(f"履歴の書き込みに失敗しました: {e}", file=sys.stderr)
+
+    def close(self):
+        """未書き込みの結果を書き切ってから書き込みスレッドを止める"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join(timeout=5)
+
+    # --- 照会 ---
+    def last_result(self, host, port):
+        """ホスト・ポートの最新の結果を返す（なければ None）"""
+        return self._query_one(
+            "SELECT device, success, latency_ms, checked_at, run_id FROM probes"
+            " WHERE host = ? AND port = ? ORDER BY checked_at DESC LIMIT 1", (host, port)
+        )
+
+    def last_success(self, host, port):
+        """ホスト・ポートが最後に応答した時の結果を返す（なければ None）"""
+        return self._query_one(
+            "SELECT device, success, latency_ms, checked_at, run_id FROM probes"
+            " WHERE host = ? AND port = ? AND success = 1 ORDER BY checked_at DESC LIMIT 1", (host, port)
+        )
+
+    def runs_per_day(self, limit=30):
+        """[(日付, 実行回数), ...] を新しい日付順に返す"""
+        conn = _connect(self.path)
+        try:
+            return conn.execute(
+                "SELECT day, COUNT(*) FROM runs GROUP BY day ORDER BY day DESC LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def _query_one(self, sql, params):
+        conn = _connect(self.path)
+        try:
+            row = conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        device, success, latency_ms, checked_at, run_id = row
+        return {
+            "device": device,
+            "success": bool(success),
+            "latency_ms": latency_ms,
+            "checked_at": datetime.fromtimestamp(checked_at),
+            "run_id": run_id,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="疎通確認履歴の照会")
+    parser.add_argument("--db", default=HISTORY_DB_PATH, help="履歴DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    last = sub.add_parser("last", help="ホスト・ポートの最新結果と最終応答日時")
+    last.add_argument("host")
+    last.add_argument("port", type=int)
+    days = sub.add_parser("days", help="日ごとの実行回数")
+    days.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"履歴DBがありません: {args.db}", file=sys.stderr)
+        return 1
+    store = HistoryStore(args.db)
+    try:
+        if args.command == "last":
+            latest = store.last_result(args.host, args.port)
+            responded = store.last_success(args.host, args.port)
+            if latest is None:
+                print(f"{args.host}:{args.port} の履歴はありません")
+                return 1
+            state = "成功" if latest["success"] else "失敗"
+            print(f"最新: {latest['checked_at']:%Y/%m/%d %H:%M:%S} {latest['device']} {state}")
+            if responded is None:
+                print("最終応答: なし")
+            else:
+                print(f"最終応答: {responded['checked_at']:%Y/%m/%d %H:%M:%S} ({responded['latency_ms']}ms)")
+        else:
+            for day, count in store.runs_per_day(args.limit):
+                print(f"{day}\t{count}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
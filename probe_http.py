@@ -0,0 +1,105 @@
+"""requests / urllib3 を使う HTTP 確認の接続まわり
+
+requests と urllib3 は読み込みに時間がかかるため、probe_engine はこのモジュールを
+最初の HTTP 確認の時点で読み込む（GUI の起動時には読み込まない）。
+"""
+import threading
+import time
+
+import requests
+import requests.adapters
+import urllib3
+import urllib3.connection
+from requests.exceptions import RequestException
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# 確認を実行中のスレッドが、実行ごとの InflightSockets・内訳の記録先・DnsCache を置く
+inflight = threading.local()
+
+
+class _TrackedHTTPConnection(urllib3.connection.HTTPConnection):
+    """応答待ち（getresponse）の間だけ、呼び出し元の実行の InflightSockets にソケットを登録する
+
+    呼び出し元が inflight.dns に DnsCache を置いていれば、名前解決はそのキャッシュで行い、
+    解決済みのアドレスに直接接続する（Host ヘッダーは入力されたホスト名のまま）。
+    inflight.timing に辞書を置いていれば、名前解決（dns）・TCP 接続（connect）・
+    ステータス行とヘッダーを受け取るまで（ttfb）の秒数を記録する。
+    keep-alive の接続を再利用した場合は dns と connect は記録されない。
+    """
+
+    def _new_conn(self):
+        dns = getattr(inflight, "dns", None)
+        timing = getattr(inflight, "timing", None)
+        if dns is None:
+            return super()._new_conn()
+        started = time.perf_counter()
+        try:
+            address = dns.resolve(self._dns_host).address
+        except (OSError, UnicodeError):
+            address = None  # エラーは urllib3 側の名前解決で改めて発生させる
+        if timing is not None:
+            timing["dns"] = time.perf_counter() - started
+        if address is not None:
+            self._dns_host = address
+        started = time.perf_counter()
+        conn = super()._new_conn()
+        if timing is not None:
+            timing["connect"] = time.perf_counter() - started
+        return conn
+
+    def getresponse(self, *args, **kwargs):
+        registry = getattr(inflight, "registry", None)
+        timing = getattr(inflight, "timing", None)
+        sock = self.sock
+        if registry is not None and sock is not None:
+            registry.add(sock)
+        started = time.perf_counter()
+        try:
+            response = super().getresponse(*args, **kwargs)
+            if timing is not None:
+                timing["ttfb"] = time.perf_counter() - started
+            return response
+        finally:
+            if registry is not None and sock is not None:
+                registry.discard(sock)
+
+
+class _TrackedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPAdapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            "http": _TrackedHTTPConnectionPool,
+        }
+
+
+def get_session(pool_size):
+    """同時実行数に合わせた接続プールを持つ共有 Session を返す
+
+    エンジンは実行のたびに作り直されるため、Session はプロセス内で共有して
+    keep-alive の接続を使い回す。
+    """
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            session = requests.Session()
+            adapter = _TrackedHTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[pool_size] = session
+        return session
+
+
+def close_sessions():
+    """共有 Session を全て閉じる（アプリ終了時に呼ぶ）"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
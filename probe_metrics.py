@@ -0,0 +1,163 @@
+"""疎通確認の応答時間メトリクス
+
+1回の実行（1拠点）ごとに、機器種別 × 段（名前解決・TCP接続・初回応答・合計）の
+ヒストグラムを作り、JSON ファイルと Prometheus の textfile 形式で書き出す。
+node_exporter の textfile collector で metrics/ を読ませれば、拠点ごとの遅延を監視できる。
+"""
+import json
+import os
+import re
+import threading
+
+METRICS_DIR = "metrics"
+# ヒストグラムの境界（秒）
+LATENCY_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TIMING_PHASES = ("dns", "connect", "ttfb", "total")
+TIMING_LABELS = {"dns": "DNS", "connect": "接続", "ttfb": "初回応答", "total": "合計"}
+SLOWEST_PORTS = 10  # 「遅いポート」に表示する件数
+
+_PROM_NAME = "pingaccess_probe_duration_seconds"
+
+
+class Histogram:
+    """Prometheus と同じ累積バケットのヒストグラム"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_SEC):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # 各境界以下の件数（累積）
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.sum += seconds
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            "buckets": {str(bound): n for bound, n in zip(self.buckets, self.counts)},
+            "sum_sec": round(self.sum, 6),
+            "count": self.count,
+        }
+
+
+def timing_of(result, phase):
+    """result の段ごとの秒数（計測できていなければ None）"""
+    return result.elapsed if phase == "total" else getattr(result, phase)
+
+
+def _measured(sweep):
+    """実際に HTTP で確認した結果（キャッシュ流用・他の確認の結果の共有と TCP 事前スキャンで弾かれたものを除く）"""
+    for result in sweep.all_results():
+        if not result.from_cache and not result.coalesced and result.stage == "http":
+            yield result
+
+
+def run_histograms(sweep):
+    """{機器種別: {段: Histogram}} を返す"""
+    histograms = {}
+    for result in _measured(sweep):
+        per_phase = histograms.setdefault(result.device, {phase: Histogram() for phase in TIMING_PHASES})
+        for phase in TIMING_PHASES:
+            seconds = timing_of(result, phase)
+            if seconds is not None:
+                per_phase[phase].observe(seconds)
+    return histograms
+
+
+def slowest_ports(sweep, limit=SLOWEST_PORTS):
+    """応答したポートを合計時間の遅い順に返す（落ちているポートは含めない）"""
+    responded = [r for r in _measured(sweep) if r.success]
+    return sorted(responded, key=lambda r: r.elapsed, reverse=True)[:limit]
+
+
+def describe_timing(result):
+    """「812ms（DNS 0 / 接続 3 / 初回応答 809）」の形式の文字列"""
+    parts = []
+    for phase in ("dns", "connect", "ttfb"):
+        seconds = timing_of(result, phase)
+        if seconds is not None:
+            parts.append(f"{TIMING_LABELS[phase]} {seconds * 1000:.0f}")
+    detail = f"（{' / '.join(parts)}）" if parts else ""
+    return f"{result.elapsed * 1000:.0f}ms{detail}"
+
+
+def metrics_to_dict(sweep, histograms=None):
+    histograms = histograms if histograms is not None else run_histograms(sweep)
+    return {
+        "run_id": sweep.run_id,
+        "site": sweep.site.get("name") or sweep.site["ip"],
+        "host": sweep.site["ip"],
+        "mode": sweep.mode,
+        "started_at": sweep.started_at.strftime("%Y/%m/%d %H:%M:%S"),
+        "histograms": {
+            device: {phase: h.to_dict() for phase, h in per_phase.items()}
+            for device, per_phase in histograms.items()
+        },
+        "slowest": [
+            {"device": r.device, "port": r.port, **{f"{p}_ms": round(timing_of(r, p) * 1000, 1)
+                                                      for p in TIMING_PHASES if timing_of(r, p) is not None}}
+            for r in slowest_ports(sweep)
+        ],
+    }
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(sweep, histograms=None):
+    """Prometheus の textfile 形式の文字列を返す"""
+    histograms = histograms if histograms is not None else run_histograms(sweep)
+    host = _label_value(sweep.site["ip"])
+    lines = [
+        f"# HELP {_PROM_NAME} 疎通確認1件あたりの所要時間（段ごと）",
+        f"# TYPE {_PROM_NAME} histogram",
+    ]
+    for device, per_phase in histograms.items():
+        for phase, h in per_phase.items():
+            labels = f'host="{host}",device="{device}",phase="{phase}"'
+            for bound, n in zip(h.buckets, h.counts):
+                lines.append(f'{_PROM_NAME}_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'{_PROM_NAME}_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f"{_PROM_NAME}_sum{{{labels}}} {h.sum:.6f}")
+            lines.append(f"{_PROM_NAME}_count{{{labels}}} {h.count}")
+
+    lines.append("# HELP pingaccess_probe_results 最後の実行の機器種別ごとの成功・失敗件数")
+    lines.append("# TYPE pingaccess_probe_results gauge")
+    for device, results in sweep.results.items():
+        if not results:
+            continue
+        success, fail = sweep.counts(device)
+        lines.append(f'pingaccess_probe_results{{host="{host}",device="{device}",result="success"}} {success}')
+        lines.append(f'pingaccess_probe_results{{host="{host}",device="{device}",result="fail"}} {fail}')
+    lines.append("# HELP pingaccess_last_run_timestamp_seconds 最後の実行の開始時刻")
+    lines.append("# TYPE pingaccess_last_run_timestamp_seconds gauge")
+    lines.append(f'pingaccess_last_run_timestamp_seconds{{host="{host}"}} {sweep.started_at.timestamp():.0f}')
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, text):
+    # textfile collector が書きかけのファイルを読まないよう、一時ファイルから置き換える
+    # 同じホストの実行が同時に終わっても一時ファイルが重ならないよう、スレッドごとに名前を変える
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        fp.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_run_metrics(sweep, directory=METRICS_DIR):
+    """実行ごとの JSON と、ホストごとに最新の実行で上書きする .prom を書き出し、両方のパスを返す
+
+    JSON のファイル名には run_id を含める（同じホストの実行が同じ秒に重なっても上書きしない）。
+    """
+    os.makedirs(directory, exist_ok=True)
+    histograms = run_histograms(sweep)
+    safe_host = re.sub(r"[^0-9A-Za-z_.-]", "_", sweep.site["ip"])
+    json_path = os.path.join(directory, f"run_{sweep.started_at:%Y%m%d_%H%M%S}_{safe_host}_{sweep.run_id}.json")
+    prom_path = os.path.join(directory, f"pingaccess_{safe_host}.prom")
+    _write_atomic(json_path, json.dumps(metrics_to_dict(sweep, histograms), ensure_ascii=False, indent=2))
+    _write_atomic(prom_path, format_prometheus(sweep, histograms))
+    return json_path, prom_path
@@ -0,0 +1,103 @@
+"""回線の継続監視
+
+設定された RT/HUB/AP のポートを一定間隔で確認し直し、状態が変わったポート
+（応答なし→応答あり、応答あり→応答なし）だけを通知する。
+確認間隔にはゆらぎ（jitter）を入れ、応答のないポートは確認間隔を段階的に延ばす。
+状態はポート数分しか持たないため、何時間動かしてもメモリ使用量は増えない。
+"""
+import random
+import time
+
+from probe_engine import MODE_BATCH
+
+MONITOR_INTERVAL_SEC = 30  # 既定の確認間隔
+MONITOR_MIN_INTERVAL_SEC = 5
+MONITOR_JITTER = 0.2  # 確認間隔を ±20% ずらし、複数回線の確認が同じ瞬間に重ならないようにする
+MONITOR_BACKOFF_FACTOR = 2.0  # 応答なしが続くポートは確認間隔をこの倍率で延ばす
+MONITOR_MAX_BACKOFF_SEC = 300  # 延ばした確認間隔の上限
+
+
+class PortState:
+    """監視中の1ポートの状態"""
+
+    __slots__ = ("device", "url", "up", "down_streak", "next_check")
+
+    def __init__(self, device, url):
+        self.device = device
+        self.url = url
+        self.up = None  # 初回の確認前は None
+        self.down_streak = 0
+        self.next_check = 0.0
+
+
+class Monitor:
+    """engine（ProbeEngine）で site を繰り返し確認する
+
+    on_change(result, previous_up) は状態が変わったポートについてのみ呼ばれる。
+    engine の stop_event がセットされると、確認中のものも含めてすぐに終了する。
+    """
+
+    def __init__(self, engine, site, mode=MODE_BATCH, interval_sec=MONITOR_INTERVAL_SEC, on_change=None,
+                 on_log=None, jitter=MONITOR_JITTER, max_backoff_sec=MONITOR_MAX_BACKOFF_SEC):
+        self.engine = engine
+        self.site = site
+        self.mode = mode
+        self.interval_sec = max(MONITOR_MIN_INTERVAL_SEC, interval_sec)
+        self.on_change = on_change
+        self.on_log = on_log
+        self.jitter = jitter
+        self.max_backoff_sec = max(self.interval_sec, max_backoff_sec)
+        self.cycles = 0
+        # RT と HUB のように番号の重なるポートを取り違えないよう、(機器種別, ポート) で引く
+        self.states = {
+            (phase.device, port): PortState(phase.device, url)
+            for phase in engine.build_phases(site, mode)
+            for _, port, url in phase.targets
+        }
+
+    def _log(self, message, level="info"):
+        if self.on_log:
+            self.on_log(message, level)
+
+    def _delay(self, state):
+        """次の確認までの秒数（応答なしが続くほど長く、最大 max_backoff_sec）"""
+        base = self.interval_sec
+        if not state.up and state.down_streak > 1:
+            base = min(self.max_backoff_sec, base * MONITOR_BACKOFF_FACTOR ** (state.down_streak - 1))
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _update(self, result, now):
+        state = self.states.get((result.device, result.port))
+        if state is None:
+            return
+        previous = state.up
+        state.up = result.success
+        state.down_streak = 0 if result.success else state.down_streak + 1
+        state.next_check = now + self._delay(state)
+        if previous is not None and previous != result.success and self.on_change:
+            self.on_change(result, previous)
+
+    def run(self):
+        """stop_event がセットされるまで監視を続ける"""
+        stop_event = self.engine.stop_event
+        self._log(f"監視開始: {len(self.states)}ポートを約{self.interval_sec:.0f}秒間隔で確認します")
+        while not stop_event.is_set():
+            # ゆらぎの幅以内に確認時刻が来るポートは1回の確認にまとめる
+            horizon = time.monotonic() + self.interval_sec * self.jitter
+            due = {port for (_, port), state in self.states.items() if state.next_check <= horizon}
+            if due:
+                sweep = self.engine.run_site(self.site, self.mode, ports=due)
+                if sweep.stopped:
+                    break
+                now = time.monotonic()
+                for result in sweep.all_results():
+                    self._update(result, now)
+                self.cycles += 1
+                if self.cycles == 1:
+                    up = sum(1 for state in self.states.values() if state.up)
+                    self._log(f"監視: 応答あり {up}件 / 応答なし {len(self.states) - up}件。以降は変化のみ通知します")
+            if not self.states:
+                break
+            next_check = min(state.next_check for state in self.states.values())
+            stop_event.wait(max(0.0, next_check - time.monotonic()))
+        self._log(f"監視終了（{self.cycles}回確認）")
@@ -0,0 +1,134 @@
+"""TCP 接続の事前スキャン
+
+HTTP 確認の前に、ポート範囲全体へノンブロッキングの TCP 接続を一斉に試みる。
+転送先の機器が落ちているポートはここで弾かれるため、HTTP 側のタイムアウトを
+ポートごとに待たずに済む。
+接続できたポートは確定した順に返すので、スキャン全体の完了を待たずに HTTP 確認を始められる。
+"""
+import errno
+import selectors
+import socket
+import time
+
+# 同時に開くソケット数の上限（Windows の select() は 512 個までしか監視できない）
+MAX_PRESCAN_SOCKETS = 256
+# 停止要求を確認する間隔（秒）
+STOP_POLL_SEC = 0.05
+
+_IN_PROGRESS = {
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    errno.EALREADY,
+    getattr(errno, "WSAEWOULDBLOCK", 10035),
+}
+
+
+def _resolve_address(host):
+    """host の接続先 (family, アドレス, sockaddr の残り) を返す（名前解決できなければ None）"""
+    try:
+        family, _, _, _, sockaddr = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0]
+    except (OSError, UnicodeError):
+        return None
+    return family, sockaddr[0], sockaddr[2:]
+
+
+def iter_tcp_prescan(probes, stop_event=None, max_sockets=MAX_PRESCAN_SOCKETS, rtt_factor=None,
+                     min_timeout_sec=0.0, rate_limiter=None, resolve=None):
+    """probes（(host, port, 待機秒数, tag) のイテラブル）へ TCP 接続を試み、
+    確定した順に (tag, 接続にかかった秒数) を返すジェネレーター（接続できなかったポートは秒数が None）
+
+    probes は同時に開くソケットが max_sockets 未満の間だけ取り出すため、リストにしなくてよい。
+    全ポートの接続を同時に待つため、所要時間はおおよそ待機秒数1回分になる。
+    rtt_factor を渡すと、そのホストで1つでも接続できた時点で残りの待機時間を
+    「それまでの最大接続時間 × rtt_factor」（min_timeout_sec 以上）に縮める。
+    rate_limiter（probe_ratelimit.RateLimiter）を渡すと、接続を開始する前に host のトークンを取り、
+    取れない間は新しい接続を開始しない（待機時間は接続を開始した時点から数える）。
+    接続先は resolve(host)（省略時は host）を名前解決して決め、解決できないホストのポートは接続できなかったものとする。
+    停止要求があった時点で、確定していないポートは返さずに終わる。
+    """
+    addresses = {}  # host -> _resolve_address() の結果
+    adaptive_limits = {}  # host -> 接続実績から決めた待機時間の上限
+    slowest = {}  # host -> 接続できたポートの最大接続時間
+
+    def expires(data):
+        host, _, deadline, started = data
+        limit = adaptive_limits.get(host)
+        return deadline if limit is None else min(deadline, started + limit)
+
+    def connected(host, elapsed):
+        slowest[host] = max(slowest.get(host, 0.0), elapsed)
+        if rtt_factor:
+            adaptive_limits[host] = max(min_timeout_sec, slowest[host] * rtt_factor)
+
+    pending = iter(probes)
+    next_probe = next(pending, None)
+    selector = selectors.DefaultSelector()
+    try:
+        while True:
+            # --- 上限（とトークン）の範囲で新しい接続を開始する ---
+            token_wait = None
+            while next_probe is not None and len(selector.get_map()) < max_sockets:
+                host, port, timeout_sec, tag = next_probe
+                if host not in addresses:
+                    addresses[host] = _resolve_address(resolve(host) if resolve else host)
+                target = addresses[host]
+                if target is not None and rate_limiter is not None:
+                    token_wait = rate_limiter.try_acquire(host)
+                    if token_wait:
+                        break
+                next_probe = next(pending, None)
+                if target is None:
+                    yield tag, None
+                    continue
+                family, address, extra = target
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                started = time.monotonic()
+                err = sock.connect_ex((address, port) + extra)
+                if err in _IN_PROGRESS:
+                    selector.register(sock, selectors.EVENT_WRITE, (host, tag, started + timeout_sec, started))
+                    continue
+                sock.close()
+                if err == 0:
+                    elapsed = time.monotonic() - started
+                    connected(host, elapsed)
+                    yield tag, elapsed
+                else:
+                    yield tag, None
+
+            if stop_event is not None and stop_event.is_set():
+                break
+            if not selector.get_map():
+                if next_probe is None:
+                    break
+                # トークン待ち。監視中のソケットがないので待つだけ
+                time.sleep(min(token_wait or 0.0, STOP_POLL_SEC))
+                continue
+
+            now = time.monotonic()
+            nearest = min(expires(key.data) for key in selector.get_map().values())
+            if token_wait:
+                nearest = min(nearest, now + token_wait)
+            for key, _ in selector.select(max(0.0, min(nearest - now, STOP_POLL_SEC))):
+                host, tag, _, started = key.data
+                ok = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                elapsed = time.monotonic() - started
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                if ok:
+                    connected(host, elapsed)
+                    yield tag, elapsed
+                else:
+                    yield tag, None
+
+            # --- 期限切れの接続を打ち切る ---
+            now = time.monotonic()
+            for key in list(selector.get_map().values()):
+                if expires(key.data) <= now:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    yield key.data[1], None
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
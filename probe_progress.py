@@ -0,0 +1,95 @@
+"""1回の実行の進捗
+
+実行開始時に RT+HUB+AP の全ポート数を total として登録し、結果が確定するたびに done を進める。
+書き込むのは実行スレッド1本だけなので、ロックは使わない（int の読み書きは GIL で不可分）。
+GUI は一定間隔でこの値を読んで進捗バーと残り時間を描画する。
+"""
+import threading
+import time
+
+
+class ProgressModel:
+    def __init__(self):
+        self.total = 0
+        self.done = 0
+        self.started = None
+
+    def start(self, total, done=0):
+        """確認対象の総数を登録する。done はキャッシュ流用などで既に確定している件数"""
+        self.started = time.perf_counter()
+        self.total = total
+        self.done = done
+
+    def advance(self, count=1):
+        self.done += count
+
+    @property
+    def ratio(self):
+        return self.done / self.total if self.total else 0.0
+
+    def eta(self):
+        """これまでの処理速度から見積もった残り秒数（見積もれない場合は None）"""
+        done, total, started = self.done, self.total, self.started
+        if started is None or done <= 0 or done >= total:
+            return None
+        rate = done / (time.perf_counter() - started)
+        return (total - done) / rate if rate > 0 else None
+
+
+class ProgressGroup:
+    """複数の拠点を並行して確認する実行（拠点リスト取込）の進捗
+
+    拠点ごとに child() で ProgressModel を渡し、その合計を ProgressModel と同じ形で返す。
+    拠点リストは1行ずつ読むため、total は開始済みの拠点の分だけ増えていく。
+    終わった拠点は release() で件数だけ合計に繰り入れ、モデル自体は保持しない。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._children = []
+        self._released_total = 0
+        self._released_done = 0
+        self.started = None
+
+    def child(self):
+        model = ProgressModel()
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter()
+            self._children.append(model)
+        return model
+
+    def release(self, model):
+        with self._lock:
+            self._children.remove(model)
+            self._released_total += model.total
+            self._released_done += model.done
+
+    @property
+    def total(self):
+        with self._lock:
+            return self._released_total + sum(model.total for model in self._children)
+
+    @property
+    def done(self):
+        with self._lock:
+            return self._released_done + sum(model.done for model in self._children)
+
+    ratio = ProgressModel.ratio
+    eta = ProgressModel.eta
+
+
+def combine(models):
+    """複数の実行の進捗を合算し、(完了数, 総数, 残り秒数) を返す
+
+    回線は並行して進むため、残り秒数は最も遅い実行の見積もりとする。
+    """
+    done = total = 0
+    etas = []
+    for model in models:
+        done += model.done
+        total += model.total
+        eta = model.eta()
+        if eta is not None:
+            etas.append(eta)
+    return done, total, max(etas) if etas else None
@@ -0,0 +1,71 @@
+"""ホスト（RT）ごとの接続レート制限
+
+HUB（50000+n）も AP（60000+n）も、同じ RT のポートフォワーディングを通る。
+一度に大量の接続を送ると RT が接続を落とし、機器が生きていても「失敗」になる。
+ホストごとにトークンバケット（毎秒 rate 個補充、最大 burst 個）を持ち、
+TCP 事前スキャン・HTTP 確認・再試行・ヘッジの全ての接続の前にトークンを1個取る。
+
+トークンの取れないホストのジョブはスケジューラーが後回しにし、その間は他のホストのジョブを
+ラウンドロビンで進める。大きな拠点がトークン待ちで同時実行枠を埋め、他の回線を待たせることはない。
+"""
+import threading
+import time
+
+RATE_LIMIT_PER_SEC = 50  # 1ホストあたり毎秒の新規接続数
+RATE_LIMIT_BURST = 20  # 一度に送ってよい接続数（通常の1拠点分の確認はこの範囲に収まる）
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_take(self, now):
+        """トークンを1個取れたら 0.0 を、取れなければ次のトークンまでの秒数を返す"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """ホストごとの TokenBucket。rate が None か 0 以下なら制限しない"""
+
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST):
+        self._lock = threading.Lock()
+        self._buckets = {}  # host -> TokenBucket
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst):
+        """レートとバーストを変更する（ホストごとの残りトークンは初期化する）"""
+        with self._lock:
+            self.rate = rate if rate and rate > 0 else None
+            self.burst = max(1, int(burst))
+            self._buckets.clear()
+
+    def try_acquire(self, host):
+        """host のトークンを1個取れたら 0.0 を、取れなければ次のトークンまでの秒数を返す（待たない）"""
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket.try_take(time.monotonic())
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """プロセス内で共有する RateLimiter を返す（全回線・全ての確認で同じものを使う）"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
@@ -0,0 +1,34 @@
+"""失敗したポートの再試行ポリシー
+
+起動途中の AP や混雑した無線バックホール越しの AP は、1回の失敗では落ちているとは限らない。
+機器種別ごとに最大試行回数・指数バックオフ（ゆらぎ付き）・全体の期限を決めて確認し直す。
+待機中はワーカーを占有しないよう、再試行はエンジン側で期限付きの待ち行列に積んでから投入する。
+"""
+import random
+
+RETRY_BACKOFF_SEC = 0.5  # 1回目の失敗後に待つ秒数（以降は倍々に延ばす）
+RETRY_MAX_BACKOFF_SEC = 4.0
+RETRY_JITTER = 0.5  # 待ち時間を ±50% ずらし、同時に失敗したポートの再試行が重ならないようにする
+HEDGE_MIN_DELAY_SEC = 0.05  # ヘッジ（2本目の同時リクエスト）を出すまでの最短時間
+
+
+class RetryPolicy:
+    def __init__(self, attempts=1, backoff_sec=RETRY_BACKOFF_SEC, max_backoff_sec=RETRY_MAX_BACKOFF_SEC,
+                 jitter=RETRY_JITTER, deadline_sec=None):
+        self.attempts = max(1, attempts)
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.jitter = jitter
+        self.deadline_sec = deadline_sec  # 1回目の開始からこの秒数を過ぎたら再試行しない
+
+    def delay(self, attempt):
+        """attempt 回目の失敗の後、次の試行までに待つ秒数"""
+        base = min(self.max_backoff_sec, self.backoff_sec * 2 ** (attempt - 1))
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def allows(self, attempt, elapsed):
+        """attempt 回試行済みで、次の試行の開始が最初の試行から elapsed 秒後になる場合に再試行してよいか"""
+        if attempt >= self.attempts:
+            return False
+        return self.deadline_sec is None or elapsed < self.deadline_sec
+
@@ -0,0 +1,68 @@
+"""応答時間（RTT）の計測結果からホストごとのタイムアウトを決める
+
+RT の確認や HUB/AP の成功応答にかかった時間をホストごとに記録し、
+その高いパーセンタイルに安全係数を掛けた値を以降のタイムアウトに使う。
+回線の状態が良い拠点では、死んでいるポートを数百ミリ秒で見切れる。
+"""
+import threading
+import time
+from collections import deque
+
+RTT_MAX_SAMPLES = 64  # ホストごとに保持するサンプル数
+RTT_MAX_AGE_SEC = 600  # これより古いサンプルは使わない（回線状態の変化に追従するため）
+RTT_PERCENTILE = 0.95
+RTT_SAFETY_FACTOR = 4.0
+ADAPTIVE_MIN_TIMEOUT_SEC = 0.3  # 適応タイムアウトの下限
+
+
+def percentile(values, q):
+    """values（ソート済みでなくてよい）の q 分位点を最近傍法で返す"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class RttTracker:
+    def __init__(self, max_samples=RTT_MAX_SAMPLES, max_age_sec=RTT_MAX_AGE_SEC):
+        self.max_samples = max_samples
+        self.max_age_sec = max_age_sec
+        self._lock = threading.Lock()
+        self._samples = {}  # host -> deque[(記録時刻, 秒)]
+
+    def record(self, host, seconds):
+        with self._lock:
+            samples = self._samples.get(host)
+            if samples is None:
+                samples = self._samples[host] = deque(maxlen=self.max_samples)
+            samples.append((time.monotonic(), seconds))
+
+    def samples(self, host):
+        """有効期限内のサンプル（秒）のリストを返す"""
+        cutoff = time.monotonic() - self.max_age_sec
+        with self._lock:
+            samples = self._samples.get(host, ())
+            return [seconds for recorded_at, seconds in samples if recorded_at >= cutoff]
+
+    def percentile(self, host, q=RTT_PERCENTILE):
+        samples = self.samples(host)
+        return percentile(samples, q) if samples else None
+
+    def timeout_for(self, host, max_timeout_sec):
+        """サンプルがあれば p95 × 安全係数（下限あり、max_timeout_sec で頭打ち）を、なければ max_timeout_sec を返す"""
+        p = self.percentile(host)
+        if p is None:
+            return max_timeout_sec
+        return min(max_timeout_sec, max(ADAPTIVE_MIN_TIMEOUT_SEC, p * RTT_SAFETY_FACTOR))
+
+
+_shared_tracker = None
+_shared_lock = threading.Lock()
+
+
+def get_rtt_tracker():
+    """プロセス内で共有する RttTracker を返す（回線タブをまたいで計測結果を使い回す）"""
+    global _shared_tracker
+    with _shared_lock:
+        if _shared_tracker is None:
+            _shared_tracker = RttTracker()
+        return _shared_tracker
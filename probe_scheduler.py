@@ -0,0 +1,189 @@
+"""複数回線の疎通確認を1つの同時実行枠で捌くスケジューラー
+
+全回線で共有するワーカースレッド（全体の同時実行数）を持ち、
+回線（実行）ごと・ホストごとの同時実行数の上限を守りながら、
+回線間でラウンドロビンにジョブを取り出す。1回線の大量ポートが
+他の回線を待たせないため、全回線がおおよそ最も遅い回線の時間で終わる。
+ホストごとの接続レート（probe_ratelimit.RateLimiter）のトークンが取れないジョブは後回しにする。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from probe_ratelimit import get_rate_limiter
+
+GLOBAL_MAX_WORKERS = 40  # 全回線合計の同時実行数
+PER_RUN_MAX_WORKERS = 10  # 1回線（1実行）あたりの同時実行数
+PER_HOST_MAX_WORKERS = 10  # 同一ホスト（同じRT）あたりの同時実行数
+WORKER_IDLE_SEC = 5.0  # ジョブがない状態がこの秒数続いたらワーカーを終了する
+
+
+class CancelToken:
+    """1回の実行ごとの停止フラグ
+
+    threading.Event と同じ is_set()/wait() を持つので、stop_event として
+    エンジンやTCP事前スキャンにそのまま渡せる。
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.cancelled_at = None  # 停止要求の時刻（time.perf_counter）。停止までの時間の計測用
+        self._event = threading.Event()
+
+    def cancel(self):
+        if self.cancelled_at is None:
+            self.cancelled_at = time.perf_counter()
+        self._event.set()
+
+    # threading.Event 互換
+    set = cancel
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class _Job:
+    __slots__ = ("run_key", "host", "fn", "args", "future")
+
+    def __init__(self, run_key, host, fn, args):
+        self.run_key = run_key
+        self.host = host
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+
+
+class ProbeScheduler:
+    def __init__(self, max_workers=GLOBAL_MAX_WORKERS, per_run=PER_RUN_MAX_WORKERS,
+                 per_host=PER_HOST_MAX_WORKERS, rate_limiter=None):
+        self.max_workers = max_workers
+        self.per_run = per_run
+        self.per_host = per_host
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self._cond = threading.Condition()
+        self._queues = {}  # run_key -> deque[_Job]（挿入順がラウンドロビンの順番）
+        self._run_limits = {}
+        self._host_limits = {}
+        self._run_active = {}
+        self._host_active = {}
+        self._queued = 0
+        self._workers = 0
+        self._idle_workers = 0
+        self._token_wait = None  # トークン待ちで取り出せなかったジョブが取り出せるまでの秒数
+
+    def submit(self, run_key, host, fn, *args, run_limit=None, host_limit=None):
+        """ジョブを run_key の待ち行列に積み、Future を返す
+
+        run_limit を指定すると、その実行の同時実行数を per_run の代わりに run_limit にする。
+        host_limit を指定すると、host への同時実行数を per_host の代わりに host_limit にする
+        （以降の全ての実行に適用される。同時実行数の自動調整用）。
+        """
+        job = _Job(run_key, host, fn, args)
+        with self._cond:
+            self._queues.setdefault(run_key, deque()).append(job)
+            self._queued += 1
+            if run_limit is not None:
+                self._run_limits[run_key] = run_limit
+            if host_limit is not None:
+                self._host_limits[host] = host_limit
+            self._spawn_worker_if_needed()
+            self._cond.notify()
+        return job.future
+
+    def cancel_run(self, run_key):
+        """run_key の未着手ジョブを全て取り消す（実行中のジョブはそのまま）"""
+        with self._cond:
+            jobs = self._queues.pop(run_key, ())
+            self._run_limits.pop(run_key, None)
+            self._queued -= len(jobs)
+        for job in jobs:
+            job.future.cancel()
+        return len(jobs)
+
+    def _spawn_worker_if_needed(self):
+        if self._queued > self._idle_workers and self._workers < self.max_workers:
+            self._workers += 1
+            threading.Thread(target=self._worker, daemon=True, name="probe-scheduler").start()
+
+    def _take_job(self):
+        """上限に空きがありトークンの取れる回線からラウンドロビンでジョブを1件取り出す（ロック保持中に呼ぶ）"""
+        self._token_wait = None
+        blocked_hosts = set()  # この呼び出しの中で取り出せないと分かったホスト
+        for run_key in list(self._queues):
+            jobs = self._queues[run_key]
+            run_limit = self._run_limits.get(run_key, self.per_run)
+            if self._run_active.get(run_key, 0) >= run_limit:
+                continue
+            for index, job in enumerate(jobs):
+                if job.host in blocked_hosts:
+                    continue
+                if self._host_active.get(job.host, 0) >= self._host_limits.get(job.host, self.per_host):
+                    blocked_hosts.add(job.host)
+                    continue
+                wait = self.rate_limiter.try_acquire(job.host)
+                if wait:
+                    blocked_hosts.add(job.host)
+                    self._token_wait = wait if self._token_wait is None else min(self._token_wait, wait)
+                    continue
+                del jobs[index]
+                self._queued -= 1
+                # 取り出した回線は末尾に回し、次は別の回線を優先する
+                self._queues.pop(run_key)
+                if jobs:
+                    self._queues[run_key] = jobs
+                else:
+                    self._run_limits.pop(run_key, None)
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._take_job()
+                while job is None:
+                    # トークン待ちのジョブがあれば、次のトークンの時刻に取り出し直す
+                    token_wait = self._token_wait
+                    self._idle_workers += 1
+                    notified = self._cond.wait(WORKER_IDLE_SEC if token_wait is None else token_wait)
+                    self._idle_workers -= 1
+                    job = self._take_job()
+                    if job is None and not notified and token_wait is None:
+                        self._workers -= 1
+                        return
+                self._run_active[job.run_key] = self._run_active.get(job.run_key, 0) + 1
+                self._host_active[job.host] = self._host_active.get(job.host, 0) + 1
+
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args))
+                    except BaseException as exc:
+                        job.future.set_exception(exc)
+            finally:
+                with self._cond:
+                    self._release(self._run_active, job.run_key)
+                    self._release(self._host_active, job.host)
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _release(counter, key):
+        counter[key] -= 1
+        if counter[key] == 0:
+            del counter[key]
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_scheduler():
+    """プロセス内で共有するスケジューラーを返す"""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = ProbeScheduler()
+        return _shared_scheduler
@@ -0,0 +1,62 @@
+"""同じポートへの同時の確認をまとめる（singleflight）
+
+2つの回線タブが同じ RT を指していたり、HUB実行と一括実行を続けて押したりすると、
+同じ http://{ip}:50000 への確認が同時に走る。(host, port) が同じ確認が実行中なら
+新しいリクエストは送らず、実行中の確認の結果を待って共有する。
+実行中の確認のタイムアウトが自分より短くても合流し（HUB実行の RT と一括実行の RT など）、
+成功ならそのまま使い、失敗なら自分のタイムアウトで確認し直す。長い場合は待たずに自分で確認する。
+
+結果の受け渡しには concurrent.futures.Future を使うため、スレッドエンジンと
+asyncio エンジン（回線ごとに別のイベントループ）の間でも共有できる。
+"""
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> (Future, タイムアウト)（実行中の確認）
+
+    def begin(self, key, timeout_sec=None):
+        """(Future, 自分が実行する側か, 実行中の確認のタイムアウト) を返す
+
+        実行する側になった場合は、確認が終わったら必ず finish() を呼ぶこと。
+        待つ側は Future の結果を受け取る。結果が None なら実行した側が停止・例外で
+        結果を共有できなかったので、もう一度 begin() からやり直す。
+        実行中の確認のタイムアウトが timeout_sec より長い場合は (None, False, …) を返すので、
+        まとめずに自分で確認する（短いタイムアウトで済む確認を長く待たせない）。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                future, running_timeout = call
+                if timeout_sec is not None and running_timeout is not None and running_timeout > timeout_sec:
+                    return None, False, running_timeout
+                return future, False, running_timeout
+            future = Future()
+            self._calls[key] = (future, timeout_sec)
+            # 実行中にしておき、待つ側の取り消し（asyncio のタスクの取り消しなど）が波及しないようにする
+            future.set_running_or_notify_cancel()
+            return future, True, timeout_sec
+
+    def finish(self, key, future, result):
+        """実行した確認の結果を待っている側に渡す（共有できない場合は None）"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call[0] is future:
+                del self._calls[key]
+        future.set_result(result)
+
+
+_shared_flight = None
+_shared_lock = threading.Lock()
+
+
+def get_single_flight():
+    """プロセス内で共有する SingleFlight を返す（回線タブをまたいで確認をまとめる）"""
+    global _shared_flight
+    with _shared_lock:
+        if _shared_flight is None:
+            _shared_flight = SingleFlight()
+        return _shared_flight
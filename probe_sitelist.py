@@ -0,0 +1,90 @@
+"""拠点リスト（作業指示ファイル）の読み込みと、拠点ごとの結果の書き出し
+
+CSV / TSV の1行が1拠点。1行目は見出しで、host 以外の列は省略できる（省略時は defaults の値）。
+
+    site,host,hub_count,hub_start,ap_count,ap_start,hub_timeout,ap_timeout
+    新宿店,192.168.1.100,1,1,6,1,2,3
+
+ファイルは1行ずつ読みながら拠点の辞書を返し、結果は拠点が終わるたびに CSV の行として書き出すため、
+何千行のファイルでも全体をメモリに読み込まない。
+"""
+import csv
+import sys
+
+from probe_engine import make_site
+
+# 見出しの別名（GUI の入力欄の名前でも書けるようにする）
+SITE_COLUMN_ALIASES = {"name": "site", "ip": "host"}
+SITE_INT_COLUMNS = ("hub_count", "hub_start", "ap_count", "ap_start")
+SITE_FLOAT_COLUMNS = ("hub_timeout", "ap_timeout")
+
+RESULT_CSV_FIELDS = ("site", "host", "device", "port", "url", "success", "error", "elapsed_ms", "dns_ms", "connect_ms",
+                     "ttfb_ms", "stage", "timeout_sec", "attempts", "hedged", "checked_at")
+
+
+def _header(name):
+    name = name.strip().lower()
+    return SITE_COLUMN_ALIASES.get(name, name)
+
+
+def read_sites(fp, defaults=None, on_log=None):
+    """fp（CSV / TSV）から拠点の辞書を1件ずつ返すジェネレーター
+
+    区切り文字は見出し行にタブがあれば TSV、なければ CSV とみなす。
+    数値が不正な行は警告して読み飛ばす。host 列がない場合は ValueError を送出する。
+    """
+    defaults = defaults or {}
+    header_line = fp.readline()
+    delimiter = "\t" if "\t" in header_line else ","
+    fieldnames = [_header(name) for name in next(csv.reader([header_line], delimiter=delimiter), [])]
+    if "host" not in fieldnames:
+        raise ValueError("拠点リストの見出しに host（または ip）列がありません")
+
+    for line_number, row in enumerate(csv.DictReader(fp, fieldnames=fieldnames, delimiter=delimiter), start=2):
+        host = (row.get("host") or "").strip()
+        if not host:
+            continue  # 空行
+        values = dict(defaults)
+        try:
+            for column in SITE_INT_COLUMNS:
+                if (row.get(column) or "").strip():
+                    values[column] = int(row[column])
+            for column in SITE_FLOAT_COLUMNS:
+                if (row.get(column) or "").strip():
+                    values[column] = float(row[column])
+        except ValueError:
+            if on_log:
+                on_log(f"拠点リスト {line_number}行目: 数字でない値があるため読み飛ばします", "warn")
+            continue
+        name = (row.get("site") or "").strip() or None
+        yield make_site(host, name=name, **values)
+
+
+def iter_site_file(path, defaults=None, on_log=None):
+    """拠点リストのファイルを開き、拠点の辞書を1件ずつ返す（"-" は標準入力）"""
+    if path == "-":
+        yield from read_sites(sys.stdin, defaults, on_log)
+        return
+    # Excel で保存した CSV の BOM を読み飛ばす
+    with open(path, encoding="utf-8-sig", newline="") as fp:
+        yield from read_sites(fp, defaults, on_log)
+
+
+class SiteResultWriter:
+    """拠点ごとの結果を CSV の行として書き出す
+
+    write() の後に毎回 flush するため、実行中でもファイルを開けば終わった拠点の結果が見える。
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.writer = csv.DictWriter(fp, fieldnames=RESULT_CSV_FIELDS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, sweep):
+        site_name = sweep.site.get("name") or sweep.site["ip"]
+        # 確認日時は結果ごとには保持していないため、拠点の実行開始時刻を書く
+        checked_at = sweep.started_at.strftime("%Y/%m/%d %H:%M:%S")
+        for result in sweep.all_results():
+            self.writer.writerow({"site": site_name, "host": sweep.site["ip"], **result.to_dict(), "checked_at": checked_at})
+        self.fp.flush()
@@ -0,0 +1,140 @@
+"""ポート番号順の結果表
+
+1フェーズ分の結果を「先頭ポートからの差（オフセット）」で引く配列として持つ。
+状態・フラグ・試行回数は1ポート1バイト、所要時間と内訳は float32 の配列に入れ、
+ProbeResult は取り出す時（ログ表示・集計・書き出し）にだけ作る。保持するオブジェクトは
+失敗のエラーだけなので、ポート数が数万あっても1ポートあたり約20バイト
+（失敗はエラーの参照分が加わり数十バイト）で済む。
+
+結果は確定した順にばらばらに届くが、手前のポートが全て確定した時点で take_ready() から
+ポート順に取り出せるため、速く応答したポートは遅いポートのタイムアウトを待たずに、順番を保ったまま表示できる。
+"""
+from array import array
+
+STATUS_ABSENT = 0  # 確認対象外（範囲外・継続監視で対象外のポート）
+STATUS_PENDING = 1
+STATUS_SUCCESS = 2
+STATUS_FAIL = 3
+
+FLAG_FROM_CACHE = 1
+FLAG_COALESCED = 2
+FLAG_HEDGED = 4
+FLAG_TCP = 8  # TCP事前スキャンで弾かれた（stage が "tcp"）
+
+_NAN = float("nan")
+
+
+def _seconds(value):
+    return _NAN if value is None else value
+
+
+def _optional(value):
+    return None if value != value else value  # NaN は「計測できなかった」
+
+
+class PortTable:
+    def __init__(self, device, host, ports, result_type):
+        """ports は確認対象のポート番号（range か、何度でも取り出せるイテラブル）
+
+        result_type は取り出す時に作る結果のクラス（probe_engine.ProbeResult）。
+        """
+        self.device = device
+        self.host = host
+        self.result_type = result_type
+        if isinstance(ports, range) and ports.step == 1:
+            self.first = ports.start
+            size = len(ports)
+            self.status = array("b", [STATUS_PENDING]) * size
+        else:
+            ports = list(ports)
+            self.first = min(ports) if ports else 0
+            size = max(ports) - self.first + 1 if ports else 0
+            self.status = array("b", [STATUS_ABSENT]) * size
+            for port in ports:
+                self.status[port - self.first] = STATUS_PENDING
+        self.flags = array("B", [0]) * size
+        self.attempts = array("B", [0]) * size
+        self.elapsed = array("f", [0.0]) * size
+        # 内訳（秒）と実際に使った接続のタイムアウト。計測できなかった段は NaN
+        self.dns = array("f", [_NAN]) * size
+        self.connect = array("f", [_NAN]) * size
+        self.ttfb = array("f", [_NAN]) * size
+        self.timeout = array("f", [_NAN]) * size
+        self.errors = {}  # オフセット -> 失敗のエラー（エラーのない失敗は持たない）
+        self._recorded = 0
+        self._next = 0  # take_ready() で次に取り出すオフセット
+
+    def put(self, result):
+        """結果を記録する（result 自体は保持しない）"""
+        offset = result.port - self.first
+        if self.status[offset] == STATUS_PENDING:
+            self._recorded += 1
+        self.status[offset] = STATUS_SUCCESS if result.success else STATUS_FAIL
+        self.flags[offset] = ((FLAG_FROM_CACHE if result.from_cache else 0) | (FLAG_COALESCED if result.coalesced else 0)
+                              | (FLAG_HEDGED if result.hedged else 0) | (FLAG_TCP if result.stage == "tcp" else 0))
+        self.attempts[offset] = min(255, result.attempts)
+        self.elapsed[offset] = result.elapsed
+        self.dns[offset] = _seconds(result.dns)
+        self.connect[offset] = _seconds(result.connect)
+        self.ttfb[offset] = _seconds(result.ttfb)
+        self.timeout[offset] = _seconds(result.timeout)
+        if result.error:
+            self.errors[offset] = result.error
+        else:
+            self.errors.pop(offset, None)
+
+    def is_pending(self, port):
+        return self.status[port - self.first] == STATUS_PENDING
+
+    def result_at(self, offset):
+        """記録済みのオフセットの結果を ProbeResult として作る"""
+        port = self.first + offset
+        flags = self.flags[offset]
+        result = self.result_type(
+            self.device, f"http://{self.host}:{port}", port, self.status[offset] == STATUS_SUCCESS,
+            error=self.errors.get(offset), elapsed=self.elapsed[offset], stage="tcp" if flags & FLAG_TCP else "http",
+            timeout=_optional(self.timeout[offset]),
+            timing={"dns": _optional(self.dns[offset]), "connect": _optional(self.connect[offset]),
+                    "ttfb": _optional(self.ttfb[offset])},
+        )
+        result.from_cache = bool(flags & FLAG_FROM_CACHE)
+        result.coalesced = bool(flags & FLAG_COALESCED)
+        result.hedged = bool(flags & FLAG_HEDGED)
+        result.attempts = self.attempts[offset]
+        return result
+
+    def take_ready(self):
+        """前回から新たにポート順に取り出せるようになった結果のリストを返す"""
+        ready = []
+        status = self.status
+        while self._next < len(status):
+            code = status[self._next]
+            if code == STATUS_PENDING:
+                break
+            if code != STATUS_ABSENT:
+                ready.append(self.result_at(self._next))
+            self._next += 1
+        return ready
+
+    def __iter__(self):
+        """記録済みの結果をポート順に返す"""
+        status = self.status
+        for offset in range(len(status)):
+            if status[offset] in (STATUS_SUCCESS, STATUS_FAIL):
+                yield self.result_at(offset)
+
+    def __len__(self):
+        """記録済みの結果の件数"""
+        return self._recorded
+
+    def counts(self):
+        """(成功件数, 失敗件数, 未確定件数) を返す"""
+        return self.status.count(STATUS_SUCCESS), self.status.count(STATUS_FAIL), self.status.count(STATUS_PENDING)
+
+    def flag_count(self, flag):
+        """記録済みの結果のうち flag（FLAG_*）の立っている件数"""
+        return sum(1 for flags in self.flags if flags & flag)  # 未記録のポートのフラグは 0
+
+    def retry_count(self):
+        """結果が確定するまでに行った再試行の合計回数"""
+        return sum(max(0, n - 1) for n in self.attempts)